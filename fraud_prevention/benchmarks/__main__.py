@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Run the benchmark suite.
+
+Usage::
+
+    python -m fraud_prevention.benchmarks --sizes 10000 100000 1000000 \
+        --output benchmarks.json
+
+    # Compare against a previous run
+    python -m fraud_prevention.benchmarks --sizes 100000 \
+        --benchmarks get_merchant_charback_woe predict_proba \
+        --output after.json
+"""
+import argparse
+
+import pandas as pd
+
+from fraud_prevention.benchmarks import suite
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument(
+        '--benchmarks', nargs='+', choices=suite.BENCHMARKS,
+        default=suite.BENCHMARKS)
+    parser.add_argument('--legacy-max-size', type=int, default=20_000)
+    parser.add_argument('--no-memory', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    results = suite.run(
+        sizes=args.sizes,
+        benchmarks=args.benchmarks,
+        legacy_max_size=args.legacy_max_size,
+        memory=not args.no_memory,
+        seed=args.seed)
+
+    print(pd.DataFrame(results).set_index(['benchmark', 'n_rows']).to_string())
+
+    if args.output is not None:
+        suite.save_report(suite.get_report(results, args.sizes), args.output)
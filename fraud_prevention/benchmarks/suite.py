@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Benchmarks of the feature, WOE, threshold table and scoring hot paths.
+
+Each benchmark is timed on synthetic data of the given sizes, generated
+with ``features.creditcard.get_synthetic_fraud``, and reports the
+transactions per second, the peak Python heap traced with ``tracemalloc``
+and the peak process RSS increase, which includes the native allocations
+of XGBoost and LightGBM.
+"""
+import sys
+import json
+import platform
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from fraud_prevention.benchmarks import utils
+from fraud_prevention.features import dataset
+from fraud_prevention.features import velocity
+from fraud_prevention.features import cc_transaction_features
+from fraud_prevention.evaluation import threshold_table
+from fraud_prevention.models import model_experiment
+
+BENCHMARKS = [
+    'process_cc_features',
+    'compute_transaction_features',
+    'compute_velocity_features',
+    'get_merchant_charback_woe',
+    'get_merchant_woe_asof',
+    'threshold_table',
+    'predict_proba'
+]
+
+
+def process_cc_features(data):
+    """Map the per credit card features over every credit card."""
+    return pd.concat([
+        cc_transaction_features.process_cc_features(cc_data)
+        for _, cc_data in data.groupby('credit_card_number', sort=False)
+    ])
+
+
+def get_model(data, n_estimators=100):
+    """Fit the benchmark model on the data features."""
+    pipeline = model_experiment.get_model_candidates()[0]['xgb']
+    pipeline.set_params(model__n_estimators=n_estimators)
+
+    return pipeline.fit(data[dataset.FEATURES], data['Class'])
+
+
+def get_benchmark_inputs(n_rows, seed=42):
+    """Get the inputs of each benchmark.
+
+    Parameters
+    -----------
+    n_rows : int
+        The number of transactions.
+    seed : int
+        The random seed.
+
+    Returns
+    --------
+    inputs : dict
+        The function and arguments of each benchmark.
+    """
+    data = utils.get_synthetic_data(n_rows, seed=seed)
+
+    dataset_data = pd.concat([
+        data,
+        cc_transaction_features.compute_transaction_features(data),
+        velocity.compute_velocity_features(data)
+    ], axis=1)
+    merchant_chargeback_woe = (
+        cc_transaction_features.get_merchant_charback_woe(data))
+    dataset_data['merchant_chargeback_woe'] = (
+        cc_transaction_features.get_merchant_woe_asof(
+            dataset_data,
+            merchant_chargeback_woe))
+    dataset_data['is_known_merchant'] = dataset_data[
+        'is_known_merchant'].astype(float)
+
+    model = get_model(dataset_data)
+    X = dataset_data[dataset.FEATURES].to_numpy(dtype=float)
+
+    return {
+        'process_cc_features': (process_cc_features, (data,)),
+        'compute_transaction_features': (
+            cc_transaction_features.compute_transaction_features, (data,)),
+        'compute_velocity_features': (
+            velocity.compute_velocity_features, (data,)),
+        'get_merchant_charback_woe': (
+            cc_transaction_features.get_merchant_charback_woe, (data,)),
+        'get_merchant_woe_asof': (
+            cc_transaction_features.get_merchant_woe_asof,
+            (data, merchant_chargeback_woe)),
+        'threshold_table': (
+            threshold_table.compute,
+            (data['Class'], model.predict_proba(X)[:, 1], data['Amount'])),
+        'predict_proba': (model.predict_proba, (X,))
+    }
+
+
+def run(sizes, benchmarks=None, legacy_max_size=20_000, memory=True,
+        seed=42):
+    """Run the benchmarks.
+
+    Parameters
+    -----------
+    sizes : list[int]
+        The numbers of transactions.
+    benchmarks : list[str]
+        The benchmarks to run, by default ``BENCHMARKS``.
+    legacy_max_size : int
+        The largest size to run the ``process_cc_features`` benchmark.
+    memory : bool
+        Set to False skips the peak memory measure, a second traced run.
+    seed : int
+        The random seed.
+
+    Returns
+    --------
+    results : list[dict]
+        The elapsed seconds, rows per second, peak Python heap and peak
+        RSS increase of each benchmark and size.
+    """
+    benchmarks = BENCHMARKS if benchmarks is None else benchmarks
+
+    results = []
+    for n_rows in sizes:
+        inputs = get_benchmark_inputs(n_rows, seed=seed)
+
+        for name in benchmarks:
+            if name == 'process_cc_features' and n_rows > legacy_max_size:
+                continue
+
+            func, args = inputs[name]
+            elapsed_time, _ = utils.timeit(func, *args)
+
+            result = {
+                'benchmark': name,
+                'n_rows': n_rows,
+                'elapsed_sec': elapsed_time,
+                'rows_per_sec': n_rows / elapsed_time
+            }
+            if memory:
+                peak_python_heap, peak_rss_delta, _ = utils.peak_memory(
+                    func, *args)
+                result['peak_python_heap_mb'] = peak_python_heap / 2**20
+                result['peak_rss_delta_mb'] = None \
+                    if peak_rss_delta is None else peak_rss_delta / 2**20
+
+            results.append(result)
+
+    return results
+
+
+def get_report(results, sizes):
+    """Get the benchmark report, with the run environment.
+
+    Parameters
+    -----------
+    results : list[dict]
+        The output of ``run``.
+    sizes : list[int]
+        The numbers of transactions.
+
+    Returns
+    --------
+    report : dict
+        The JSON serializable report.
+    """
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sizes': list(sizes),
+        'results': results
+    }
+
+
+def save_report(report, path):
+    """Save the benchmark report as JSON.
+
+    Parameters
+    -----------
+    report : dict
+        The output of ``get_report``.
+    path : str
+        The JSON file path.
+    """
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
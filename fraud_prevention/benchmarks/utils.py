@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from fraud_prevention import instrumentation
+from fraud_prevention.features import schema
+from fraud_prevention.features import creditcard
+
+
+def get_raw_data(n_rows, fraud_rate=.0017, seed=42):
+    """Get a random dataset with the layout of ``data.creditcard.get``.
+
+    Parameters
+    -----------
+    n_rows : int
+        The number of transactions.
+    fraud_rate : float
+        The fraction of fraudulent transactions, by default the one of
+        the original dataset.
+    seed : int
+        The random seed.
+
+    Returns
+    --------
+    data : pandas.DataFrame
+        The data.
+    """
+    rng = np.random.default_rng(seed)
+
+    data = pd.DataFrame({
+        'Time': np.sort(
+            rng.uniform(0, 172_792 * n_rows / 284_807, n_rows)
+        ).round()
+    })
+    for i in range(1, 29):
+        data[f'V{i}'] = rng.normal(size=n_rows)
+    data['Amount'] = rng.exponential(88, n_rows).round(2)
+    data['Class'] = (rng.random(n_rows) < fraud_rate).astype(int)
+
+    return data
+
+
+def get_synthetic_data(n_rows, seed=42):
+    """Get a random dataset with the layout of ``features.creditcard.get``.
+
+    Parameters
+    -----------
+    n_rows : int
+        The number of transactions.
+    seed : int
+        The random seed.
+
+    Returns
+    --------
+    data : pandas.DataFrame
+        The data.
+    """
+    data = get_raw_data(n_rows, seed=seed)
+    data_synthetic = creditcard.get_synthetic_fraud(
+        data,
+        max_group_size=7,
+        seed=seed)
+
+    data = schema.apply(
+        pd.concat([
+            data_synthetic.reset_index(drop=True),
+            data.drop(['Time'], axis=1).reset_index(drop=True)
+        ], axis=1),
+        schema.CREDIT_CARD_DTYPES)
+
+    return data
+
+
+def timeit(func, *args, **kwargs):
+    """Time a function call.
+
+    Returns
+    --------
+    elapsed_time : float
+        The wall time in seconds.
+    result : object
+        The output of the function.
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed_time = time.perf_counter() - start
+
+    return elapsed_time, result
+
+
+def peak_memory(func, *args, interval=.001, **kwargs):
+    """Get the peak memory allocated by a function call.
+
+    Two peaks are measured over the memory before the call:
+
+    - the Python heap, traced with ``tracemalloc``. It misses the memory
+      allocated natively, e.g. by XGBoost or LightGBM in ``predict_proba``.
+    - the process RSS, sampled every ``interval`` seconds from a thread,
+      which includes the native allocations but not the memory already
+      resident, e.g. reused from a previous call of the function.
+
+    Tracing slows down the call, time it separately.
+
+    Returns
+    --------
+    peak_python_heap : int
+        The peak traced Python heap in bytes.
+    peak_rss_delta : int
+        The peak sampled RSS increase in bytes, None where the RSS is not
+        available.
+    result : object
+        The output of the function.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+
+    tracemalloc.reset_peak()
+    start, _ = tracemalloc.get_traced_memory()
+    try:
+        with instrumentation.PeakRssSampler(interval) as rss_sampler:
+            result = func(*args, **kwargs)
+    finally:
+        _, peak = tracemalloc.get_traced_memory()
+        if not was_tracing:
+            tracemalloc.stop()
+
+    peak_rss_delta = None if rss_sampler.start_rss_mb is None \
+        else int((rss_sampler.peak_rss_mb - rss_sampler.start_rss_mb) * 2**20)
+
+    return peak - start, peak_rss_delta, result
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Merchant chargeback WOE benchmark.
+
+Compares how ``cc_transaction_features.get_merchant_charback_woe`` and the
+former per window ``WOEEncoder`` refit scale with the history length.
+
+Usage::
+
+    python -m fraud_prevention.benchmarks.woe --sizes 10000 50000 100000
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+from category_encoders.woe import WOEEncoder
+
+from fraud_prevention.benchmarks import utils
+from fraud_prevention.features import cc_transaction_features
+
+
+def refit_merchant_charback_woe(data, window_size=500):
+    """Reference implementation refitting a WOEEncoder per time window.
+    """
+    timestamps = data[
+        'timestamp'
+    ].apply(
+        lambda x: x - (x % window_size)
+    ).sort_values().drop_duplicates()
+
+    merchant_chargeback_woe = []
+    for time in timestamps:
+        time_data = data[data['timestamp'] < time]
+
+        if time_data['Class'].sum() < 10:
+            continue
+
+        encoder = WOEEncoder(
+            cols=['merchant']
+        ).fit(
+            time_data['merchant'],
+            time_data['Class'])
+
+        merchant_encoder = encoder.mapping['merchant']
+        weights = pd.Series(
+            merchant_encoder.values,
+            index=encoder.ordinal_encoder.inverse_transform(
+                pd.DataFrame(
+                    {
+                        "merchant": merchant_encoder.index
+                    }
+                )
+            )['merchant'].tolist()
+        ).sort_values().to_dict()
+        weights['timestamp'] = time
+        merchant_chargeback_woe.append(weights)
+
+    merchant_chargeback_woe = pd.DataFrame(
+        merchant_chargeback_woe
+    ).set_index('timestamp')
+
+    merchant_chargeback_woe = merchant_chargeback_woe.T
+    merchant_chargeback_woe[None] = np.nan
+    merchant_chargeback_woe = merchant_chargeback_woe.T
+
+    return merchant_chargeback_woe
+
+
+def run(sizes, window_size=500, refit_max_size=100_000):
+    """Run the benchmark.
+
+    Parameters
+    -----------
+    sizes : list[int]
+        The history lengths, in number of transactions.
+    window_size : int
+        The time window size.
+    refit_max_size : int
+        The largest history length to time the reference implementation.
+
+    Returns
+    --------
+    results : pandas.DataFrame
+        The elapsed seconds and transactions per second per history length.
+    """
+    results = []
+    for n_rows in sizes:
+        data = utils.get_synthetic_data(n_rows)
+
+        elapsed_time, woe = utils.timeit(
+            cc_transaction_features.get_merchant_charback_woe,
+            data,
+            window_size=window_size)
+
+        result = {
+            'n_rows': n_rows,
+            'n_windows': len(woe),
+            'cumulative_sec': elapsed_time,
+            'cumulative_rows_per_sec': n_rows / elapsed_time
+        }
+
+        if (n_rows <= refit_max_size) and (len(woe) > 1):
+            elapsed_time, woe_refit = utils.timeit(
+                refit_merchant_charback_woe,
+                data,
+                window_size=window_size)
+
+            result['refit_sec'] = elapsed_time
+            result['refit_rows_per_sec'] = n_rows / elapsed_time
+            result['max_abs_diff'] = np.nanmax(np.abs(
+                woe_refit.values - woe[woe_refit.columns].values))
+
+        results.append(result)
+
+    results = pd.DataFrame(results).set_index('n_rows')
+
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+',
+        default=[10_000, 50_000, 100_000, 500_000])
+    parser.add_argument('--window-size', type=int, default=500)
+    parser.add_argument('--refit-max-size', type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(run(
+        sizes=args.sizes,
+        window_size=args.window_size,
+        refit_max_size=args.refit_max_size).to_string())
@@ -1,68 +1,172 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import numpy as np
 import pandas as pd
 
 
-def compute(y_true, y_score, weights):
-    """Compute model score threshold table.
+def get_score_thresholds(y_score, decimals=3, n_bins=None):
+    """Get the candidate score thresholds.
 
     Parameters
     -----------
-    y_true : pandas.Series
-        Array containing the ground-truth.
-    y_score : pandas.Series
-        Array containing the model scores
+    y_score : numpy.ndarray
+        Array containing the model scores.
+    decimals : int
+        The thresholds are the distinct scores rounded to this number of
+        decimals.
+    n_bins : int
+        If given, the thresholds are instead the distinct score quantiles
+        splitting the scores in ``n_bins`` bins of equal size.
 
     Returns
     -------
-    threshold_table : pandas.DataFrame
-        The pandas dataframe with the cut-table.
+    thresholds : numpy.ndarray
+        The sorted score thresholds.
     """
+    y_score = y_score[~np.isnan(y_score)]
 
-    nb_transactions = len(y_true)
-
-    is_fraud = y_true == 1
+    if n_bins is None:
+        thresholds = np.unique(np.round(y_score, decimals))
+    else:
+        thresholds = np.unique(np.quantile(
+            y_score,
+            np.linspace(0, 1, n_bins + 1)))
 
-    score_candidates_for_threshold = (
-        y_score.round(3).drop_duplicates().sort_values())
+    return thresholds
 
-    threshold_table = []
-    for score in score_candidates_for_threshold:
-        is_accepted = (y_score <= score)
-        is_rejected = (y_score > score)
 
-        nb_accepted = is_accepted.sum()
-        nb_rejected = is_rejected.sum()
+def compute(y_true, y_score, weights=None, decimals=3, n_bins=None):
+    """Compute model score threshold table.
 
-        acceptance_rate = nb_accepted / nb_transactions
+    Transactions with a score lower or equal than the threshold are
+    accepted, the rest are rejected. The scores are sorted once and the
+    counts of every threshold are read from cumulative sums, so the cost
+    is O(n log n) regardless of the number of thresholds.
 
-        accepted_nb_fraud = (is_fraud & is_accepted).sum()
-        rejected_nb_fraud = (is_fraud & is_rejected).sum()
+    Parameters
+    -----------
+    y_true : pandas.Series
+        Array containing the ground-truth.
+    y_score : pandas.Series
+        Array containing the model scores
+    weights : pandas.Series
+        Array containing the transaction amounts. If given, the table
+        includes the accepted and rejected amounts of fraud and no fraud,
+        and the fraud percent of the accepted and rejected amounts.
+    decimals : int
+        The thresholds are the distinct scores rounded to this number of
+        decimals, in the dtype of the scores.
+    n_bins : int
+        If given, the thresholds are instead the distinct score quantiles
+        splitting the scores in ``n_bins`` bins of equal size.
 
-        accepted_nb_no_fraud = ((~is_fraud) & is_accepted).sum()
-        rejected_nb_no_fraud = ((~is_fraud) & is_rejected).sum()
+    Returns
+    -------
+    threshold_table : pandas.DataFrame
+        The pandas dataframe with the cut-table.
+    """
+    y_true = np.asarray(y_true)
 
-        if nb_accepted != 0:
-            accepted_fraud_percent = accepted_nb_fraud / nb_accepted
-        else:
-            accepted_fraud_percent = 0
+    # Rounded and compared in the score dtype, e.g. float32 for XGBoost, so
+    # a score equal to its rounded threshold is accepted
+    y_score = np.asarray(y_score)
+    if not np.issubdtype(y_score.dtype, np.floating):
+        y_score = y_score.astype(float)
 
-        if nb_rejected != 0:
-            rejected_fraud_percent = rejected_nb_fraud / nb_rejected
-        else:
-            rejected_fraud_percent = 0
+    nb_transactions = len(y_true)
 
-        threshold_table.append({
-            'score': score,
-            'acceptance_rate': acceptance_rate,
-            'nb_accepted': nb_accepted,
-            'nb_rejected': nb_rejected,
-            'accepted_nb_fraud': accepted_nb_fraud,
-            'rejected_nb_fraud': rejected_nb_fraud,
-            'accepted_nb_no_fraud': accepted_nb_no_fraud,
-            'rejected_nb_no_fraud': rejected_nb_no_fraud,
-            'accepted_fraud_percent': accepted_fraud_percent,
-            'rejected_fraud_percent': rejected_fraud_percent
+    # Transactions without score are neither accepted nor rejected
+    has_score = ~np.isnan(y_score)
+    order = np.argsort(y_score[has_score], kind='mergesort')
+    y_score_sorted = y_score[has_score][order]
+    is_fraud_sorted = (y_true[has_score] == 1)[order]
+
+    if weights is not None:
+        # Missing amounts do not add to the amount sums
+        weights_sorted = np.nan_to_num(
+            np.asarray(weights, dtype=float)[has_score][order])
+
+    score = get_score_thresholds(
+        y_score,
+        decimals=decimals,
+        n_bins=n_bins)
+
+    # Number of transactions with a score lower or equal than each threshold
+    nb_accepted = np.searchsorted(y_score_sorted, score, side='right')
+    nb_rejected = len(y_score_sorted) - nb_accepted
+
+    cum_nb_fraud = np.concatenate([[0], np.cumsum(is_fraud_sorted)])
+    accepted_nb_fraud = cum_nb_fraud[nb_accepted]
+    rejected_nb_fraud = cum_nb_fraud[-1] - accepted_nb_fraud
+
+    accepted_nb_no_fraud = nb_accepted - accepted_nb_fraud
+    rejected_nb_no_fraud = nb_rejected - rejected_nb_fraud
+
+    acceptance_rate = nb_accepted / nb_transactions
+
+    accepted_fraud_percent = np.divide(
+        accepted_nb_fraud,
+        nb_accepted,
+        out=np.zeros(len(score)),
+        where=nb_accepted != 0)
+
+    rejected_fraud_percent = np.divide(
+        rejected_nb_fraud,
+        nb_rejected,
+        out=np.zeros(len(score)),
+        where=nb_rejected != 0)
+
+    threshold_table = {
+        'score': score,
+        'acceptance_rate': acceptance_rate,
+        'nb_accepted': nb_accepted,
+        'nb_rejected': nb_rejected,
+        'accepted_nb_fraud': accepted_nb_fraud,
+        'rejected_nb_fraud': rejected_nb_fraud,
+        'accepted_nb_no_fraud': accepted_nb_no_fraud,
+        'rejected_nb_no_fraud': rejected_nb_no_fraud,
+        'accepted_fraud_percent': accepted_fraud_percent,
+        'rejected_fraud_percent': rejected_fraud_percent
+    }
+
+    if weights is not None:
+        cum_amount_fraud = np.concatenate([
+            [0],
+            np.cumsum(np.where(is_fraud_sorted, weights_sorted, 0))])
+        cum_amount_no_fraud = np.concatenate([
+            [0],
+            np.cumsum(np.where(is_fraud_sorted, 0, weights_sorted))])
+
+        accepted_amount_fraud = cum_amount_fraud[nb_accepted]
+        rejected_amount_fraud = cum_amount_fraud[-1] - accepted_amount_fraud
+
+        accepted_amount_no_fraud = cum_amount_no_fraud[nb_accepted]
+        rejected_amount_no_fraud = (
+            cum_amount_no_fraud[-1] - accepted_amount_no_fraud)
+
+        accepted_amount = accepted_amount_fraud + accepted_amount_no_fraud
+        rejected_amount = rejected_amount_fraud + rejected_amount_no_fraud
+
+        # Chargeback dollars rate
+        accepted_amount_fraud_percent = np.divide(
+            accepted_amount_fraud,
+            accepted_amount,
+            out=np.zeros(len(score)),
+            where=accepted_amount != 0)
+
+        rejected_amount_fraud_percent = np.divide(
+            rejected_amount_fraud,
+            rejected_amount,
+            out=np.zeros(len(score)),
+            where=rejected_amount != 0)
+
+        threshold_table.update({
+            'accepted_amount_fraud': accepted_amount_fraud,
+            'rejected_amount_fraud': rejected_amount_fraud,
+            'accepted_amount_no_fraud': accepted_amount_no_fraud,
+            'rejected_amount_no_fraud': rejected_amount_no_fraud,
+            'accepted_amount_fraud_percent': accepted_amount_fraud_percent,
+            'rejected_amount_fraud_percent': rejected_amount_fraud_percent
         })
 
     threshold_table = pd.DataFrame(threshold_table).set_index('score')
@@ -1,28 +1,45 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
+import json
+import logging
+import tempfile
+import threading
+from functools import partial
 
 import numpy as np
 from tqdm import tqdm
 import pandas as pd
+import pyarrow.parquet as pq
 from multiprocess import cpu_count
-from geopy.distance import geodesic
 from joblib import Parallel, delayed
-from category_encoders.woe import WOEEncoder
 
 from fraud_prevention import config
+from fraud_prevention import instrumentation
+from fraud_prevention.features import schema
+from fraud_prevention.features import storage
 from fraud_prevention.features import creditcard
+from fraud_prevention.features import geo_distance
+from fraud_prevention.features import velocity
 
+LOGGER = logging.getLogger(__name__)
 
+
+# Partitioned by time bucket, see ``features.storage``
 PATH = os.path.join(
     config.PRJ_DIR,
     'data/processed/cc_transaction_features.parquet')
 
-# Aux. variable to async computation
-DATA_GRP = None
+# State carried forward to process the next incremental update
+CHECKPOINT_DIR = os.path.join(
+    config.PRJ_DIR,
+    'data/interim/cc_transaction_features_checkpoint')
+
+WINDOW_SIZE = 500
 
 
-def apply_threading(func, data, n_jobs=None, verbose=True):
+def apply_threading(func, data, n_jobs=None, verbose=True,
+                    backend='threading'):
     """Map a parallel function to a list using multithreading.
 
     Params:
@@ -35,6 +52,10 @@ def apply_threading(func, data, n_jobs=None, verbose=True):
         number of threads
     verbose : bool
         Set to False prevents the display of the progress bar.
+    backend: str
+        The joblib backend, 'threading' or a process-pool backend such as
+        'loky' or 'multiprocessing'. With a process-pool backend ``func``
+        and its arguments must be picklable.
 
     Return:
     ---------
@@ -65,14 +86,14 @@ def apply_threading(func, data, n_jobs=None, verbose=True):
     if verbose:
         result = Parallel(
             n_jobs=n_jobs,
-            backend='threading'
+            backend=backend
         )(
             delayed(func)(i) for i in tqdm(data)
         )
     else:
         result = Parallel(
             n_jobs=n_jobs,
-            backend='threading'
+            backend=backend
         )(
             delayed(func)(i) for i in data
         )
@@ -109,19 +130,19 @@ def geo_distance_diff(geo1, geo2):
         feature_utils.geo_distance_diff(
             geo1=geo1,
             geo2=geo2)
-        Out[1]: 559.0423365035714
+        Out[1]: 559.0423365044244
 
     """
-    return geodesic(geo1, geo2).kilometers
+    return float(geo_distance.geodesic(*geo1, *geo2))
 
 
-def process_cc_features(cc_number):
+def process_cc_features(cc_data):
     """Process the features of a single credit card.
 
     Parameters
     ----------
-    cc_number : int
-        The credit card number.
+    cc_data : pandas.DataFrame
+        The transactions of the credit card.
 
     Return
     ------
@@ -129,31 +150,17 @@ def process_cc_features(cc_number):
         The data with the transaction features.
 
     """
-    global DATA_GRP
     try:
-        cc_data = DATA_GRP.get_group(cc_number)
-        cc_data.sort_values('timestamp', inplace=True)
+        cc_data = cc_data.sort_values('timestamp')
 
         # Geolocation features
-        geo_pairs_index = zip(
-            cc_data[[
-                'latitude',
-                'longitude'
-            ]][:-1].values.tolist(),
-            cc_data[[
-                'latitude',
-                'longitude'
-            ]][1:].values.tolist(),
-            cc_data.index[1:])
-
-        diff_geo = []
-        for prev_geo, current_geo, index in geo_pairs_index:
-            diff_geo.append({
-                "index": index,
-                "km_dist_prev_transaction": geo_distance_diff(
-                    geo1=prev_geo,
-                    geo2=current_geo)
-            })
+        geo = cc_data[['latitude', 'longitude']].to_numpy(dtype=float)
+        diff_geo = pd.DataFrame({
+            "index": cc_data.index[1:],
+            "km_dist_prev_transaction": geo_distance.geodesic(
+                lat1=geo[:-1, 0], lon1=geo[:-1, 1],
+                lat2=geo[1:, 0], lon2=geo[1:, 1])
+        })
 
         # Transaction velocity features
         time_pairs_index = zip(
@@ -178,7 +185,7 @@ def process_cc_features(cc_number):
             })
 
         # User behavior features
-        is_known_merchant, prev_merchants = [], []
+        is_known_merchant, prev_merchants = [], set()
         for idx, m in cc_data['merchant'].to_dict().items():
             if not (m in prev_merchants):
                 is_known = False
@@ -189,7 +196,7 @@ def process_cc_features(cc_number):
                 "index": idx,
                 "is_known_merchant": is_known,
             })
-            prev_merchants.append(m)
+            prev_merchants.add(m)
 
         # Features
         cc_transaction_features = pd.concat([
@@ -200,12 +207,370 @@ def process_cc_features(cc_number):
 
     except Exception as err:
         print(err)
-        print(f'cc_number: {cc_number}')
+        print(f"cc_number: {cc_data['credit_card_number'].iloc[0]}")
         cc_transaction_features = pd.DataFrame()
 
     return cc_transaction_features
 
 
+def compute_transaction_features(data, distance_method='geodesic'):
+    """Compute the transaction features of all the credit cards at once.
+
+    Columnar alternative to mapping ``process_cc_features`` over every
+    credit card. The data is sorted once by credit card number and
+    timestamp, and the features are derived from the shifted arrays.
+
+    Besides the ``process_cc_features`` features, it computes the number
+    of distinct merchants of the card before the transaction
+    (``nb_known_merchants``) and the time since the previous transaction
+    of the card at the same merchant (``time_prev_merchant_transaction``).
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, with at least the columns ``credit_card_number``,
+        ``timestamp``, ``latitude``, ``longitude`` and ``merchant``.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+
+    Return
+    ------
+    cc_transaction_features : pandas.DataFrame
+        The data with the transaction features, indexed as ``data``.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import creditcard
+        from fraud_prevention.features import cc_transaction_features
+
+        data = creditcard.get()
+
+        cc_transaction_features.compute_transaction_features(data).head()
+        Out[1]:
+           time_prev_transaction  km_dist_prev_transaction  is_known_merchant
+        0                    NaN                       NaN              False
+        1                   30.0               1046.612344              False
+        2                   10.0                580.128416               True
+        3                   60.0               1383.436123               True
+        4                   30.0                992.584401              False
+
+    """
+    cc_codes = pd.factorize(data['credit_card_number'])[0]
+    merchant_codes = pd.factorize(data['merchant'])[0]
+    timestamp = data['timestamp'].to_numpy(dtype=float)
+
+    # Sort once by (credit card, timestamp), lexsort is stable
+    order = np.lexsort((timestamp, cc_codes))
+
+    cc_codes = cc_codes[order]
+    merchant_codes = merchant_codes[order]
+    timestamp = timestamp[order]
+    latitude = data['latitude'].to_numpy(dtype=float)[order]
+    longitude = data['longitude'].to_numpy(dtype=float)[order]
+
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = cc_codes[1:] != cc_codes[:-1]
+
+    # Transaction velocity features
+    time_prev_transaction = np.full(len(order), np.nan)
+    time_prev_transaction[1:] = timestamp[1:] - timestamp[:-1]
+    time_prev_transaction[is_first] = np.nan
+
+    # Geolocation features
+    km_dist_prev_transaction = np.full(len(order), np.nan)
+    km_dist_prev_transaction[1:] = geo_distance.distance(
+        lat1=latitude[:-1], lon1=longitude[:-1],
+        lat2=latitude[1:], lon2=longitude[1:],
+        method=distance_method)
+    km_dist_prev_transaction[is_first] = np.nan
+
+    # User behavior features. The stable sort by (credit card, merchant)
+    # keeps the transactions of each pair in time order.
+    merchant_order = np.lexsort((merchant_codes, cc_codes))
+    is_prev_same_merchant = np.zeros(len(order), dtype=bool)
+    is_prev_same_merchant[1:] = (
+        cc_codes[merchant_order][1:] == cc_codes[merchant_order][:-1]
+    ) & (
+        merchant_codes[merchant_order][1:] ==
+        merchant_codes[merchant_order][:-1]
+    )
+
+    is_known_merchant = np.empty(len(order), dtype=bool)
+    is_known_merchant[merchant_order] = is_prev_same_merchant
+
+    time_prev_merchant_transaction = np.full(len(order), np.nan)
+    time_prev_merchant_transaction[
+        merchant_order[is_prev_same_merchant]
+    ] = np.diff(timestamp[merchant_order])[is_prev_same_merchant[1:]]
+
+    # Distinct merchants of the card before the transaction
+    nb_new_merchants = np.cumsum(~is_known_merchant)
+    nb_new_merchants -= ~is_known_merchant
+    card_start = np.maximum.accumulate(
+        np.where(is_first, np.arange(len(order)), 0))
+    nb_known_merchants = nb_new_merchants - nb_new_merchants[card_start]
+
+    # Cards with a single transaction have no features at all,
+    # as in the output of ``process_cc_features``.
+    is_last = np.ones(len(order), dtype=bool)
+    is_last[:-1] = cc_codes[:-1] != cc_codes[1:]
+    is_single = is_first & is_last
+    if is_single.any():
+        is_known_merchant = is_known_merchant.astype(object)
+        is_known_merchant[is_single] = np.nan
+
+    # Back to the original row order
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    cc_transaction_features = pd.DataFrame({
+        'time_prev_transaction': time_prev_transaction[position],
+        'km_dist_prev_transaction': km_dist_prev_transaction[position],
+        'is_known_merchant': is_known_merchant[position],
+        'nb_known_merchants': nb_known_merchants[position],
+        'time_prev_merchant_transaction': time_prev_merchant_transaction[
+            position]
+    }, index=data.index)
+
+    return cc_transaction_features
+
+
+def _process_card_range(card_range, columns_dir, distance_method='geodesic'):
+    """Compute the transaction features of a range of sorted rows.
+
+    Parameters
+    ----------
+    card_range : Tuple(int, int)
+        The start and stop offsets of the rows, on credit card boundaries.
+    columns_dir : str
+        The folder of the memory-mapped sorted columns.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+
+    Return
+    ------
+    cc_transaction_features : pandas.DataFrame
+        The transaction features, indexed by the sorted row offsets.
+    """
+    start, stop = card_range
+
+    cc_data = pd.DataFrame({
+        name: np.load(
+            os.path.join(columns_dir, f'{name}.npy'),
+            mmap_mode='r')[start:stop]
+        for name in [
+            'credit_card_number', 'merchant', 'timestamp', 'latitude',
+            'longitude']
+    }, index=pd.RangeIndex(start, stop))
+
+    return compute_transaction_features(
+        cc_data,
+        distance_method=distance_method)
+
+
+def compute_transaction_features_parallel(data, n_jobs=None, backend='loky',
+                                          distance_method='geodesic',
+                                          temp_folder=None, verbose=True):
+    """Compute the transaction features over a pool of workers.
+
+    The feature columns are sorted once by credit card number and
+    timestamp and written as memory-mapped arrays. The workers map them
+    and receive only the offsets of a range of credit cards, so the data
+    is never pickled to the workers.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, with at least the columns ``credit_card_number``,
+        ``timestamp``, ``latitude``, ``longitude`` and ``merchant``.
+    n_jobs : int
+        The number of workers, by default the number of CPUs.
+    backend : str
+        The ``apply_threading`` backend.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+    temp_folder : str
+        The folder of the memory-mapped arrays, by default the system
+        temporary folder. A RAM backed folder such as ``/dev/shm`` shares
+        the arrays in memory.
+    verbose : bool
+        Set to False prevents the display of the progress bar.
+
+    Return
+    ------
+    cc_transaction_features : pandas.DataFrame
+        The data with the transaction features, indexed as ``data``.
+    """
+    if n_jobs is None:
+        n_jobs = cpu_count()
+
+    if n_jobs == 1 or len(data) == 0:
+        return compute_transaction_features(
+            data,
+            distance_method=distance_method)
+
+    cc_codes = pd.factorize(data['credit_card_number'])[0]
+    order = np.lexsort((data['timestamp'].to_numpy(dtype=float), cc_codes))
+
+    columns = {
+        'credit_card_number': cc_codes[order],
+        'merchant': pd.factorize(data['merchant'])[0][order],
+        'timestamp': data['timestamp'].to_numpy(dtype=float)[order],
+        'latitude': data['latitude'].to_numpy(dtype=float)[order],
+        'longitude': data['longitude'].to_numpy(dtype=float)[order]
+    }
+
+    # About four card ranges of equal size per worker, never splitting
+    # the transactions of a card
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = columns['credit_card_number'][1:] != columns[
+        'credit_card_number'][:-1]
+    card_starts = np.flatnonzero(is_first)
+    offsets = np.unique(np.append(
+        card_starts[np.searchsorted(
+            card_starts,
+            np.linspace(0, len(order), 4 * n_jobs, endpoint=False),
+            side='right') - 1],
+        len(order)))
+
+    with tempfile.TemporaryDirectory(dir=temp_folder) as columns_dir:
+        for name, values in columns.items():
+            np.save(os.path.join(columns_dir, f'{name}.npy'), values)
+
+        cc_transaction_features = pd.concat(apply_threading(
+            partial(
+                _process_card_range,
+                columns_dir=columns_dir,
+                distance_method=distance_method),
+            list(zip(offsets[:-1], offsets[1:])),
+            n_jobs=n_jobs,
+            verbose=verbose,
+            backend=backend))
+
+    # Back to the original row order
+    position = np.empty_like(order)
+    position[order] = np.arange(len(order))
+
+    cc_transaction_features = cc_transaction_features.iloc[position]
+    cc_transaction_features.index = data.index
+
+    return cc_transaction_features
+
+
+def get_merchant_window_counts(data, window_size=500):
+    """Get the merchant transaction counts before each time window.
+
+    Parameters
+    -----------
+    data : pandas.DataFrame
+        The data.
+    window_size : int
+        The time window size.
+
+    Returns
+    -------
+    nb_fraud : pandas.DataFrame
+        The number of fraudulent transactions per merchant (columns) with a
+        timestamp strictly before each time window (index).
+    nb_transactions : pandas.DataFrame
+        The number of transactions per merchant (columns) with a timestamp
+        strictly before each time window (index).
+    """
+    window = data['timestamp'] - (data['timestamp'] % window_size)
+    window.name = 'timestamp'
+
+    stats = data.groupby(
+        [window, data['merchant']],
+        observed=True
+    )['Class'].agg(['sum', 'count'])
+
+    # Merchants in order of appearance, as the WOEEncoder ordinal encoding
+    merchants = data['merchant'].drop_duplicates()
+    merchants = merchants[merchants.isin(stats.index.levels[1])]
+
+    # A transaction is before a window iff its own window is before it
+    nb_fraud = stats['sum'].unstack(fill_value=0)[merchants].cumsum().shift(
+        1, fill_value=0)
+    nb_transactions = stats['count'].unstack(fill_value=0)[
+        merchants
+    ].cumsum().shift(1, fill_value=0)
+
+    return nb_fraud, nb_transactions
+
+
+def compute_merchant_woe(nb_fraud, nb_transactions, regularization=1.0):
+    """Compute the merchant weight of evidence from the transaction counts.
+
+    Computes the same regularized weight of evidence as
+    ``category_encoders.woe.WOEEncoder`` fitted on the transactions before
+    each time window. Windows with less than 10 frauds are skipped.
+
+    Parameters
+    -----------
+    nb_fraud : pandas.DataFrame
+        The number of fraudulent transactions per merchant and time window.
+    nb_transactions : pandas.DataFrame
+        The number of transactions per merchant and time window.
+    regularization : float
+        The ``WOEEncoder`` regularization.
+
+    Returns
+    -------
+    merchant_chargeback_woe : pandas.DataFrame
+        The merchants chargeback weight of evidence at a give timestamp.
+    """
+    total_fraud = nb_fraud.sum(axis=1)
+    total_transactions = nb_transactions.sum(axis=1)
+
+    is_valid = total_fraud >= 10
+    nb_fraud = nb_fraud[is_valid]
+    nb_transactions = nb_transactions[is_valid]
+    total_fraud = total_fraud[is_valid]
+    total_transactions = total_transactions[is_valid]
+
+    nominator = (
+        nb_fraud + regularization
+    ).div(
+        total_fraud + 2 * regularization,
+        axis=0)
+    denominator = (
+        (nb_transactions - nb_fraud) + regularization
+    ).div(
+        total_transactions - total_fraud + 2 * regularization,
+        axis=0)
+
+    merchant_chargeback_woe = np.log(nominator / denominator)
+
+    # Ignore unique values, unseen merchants have no weight of evidence
+    merchant_chargeback_woe[nb_transactions == 1] = 0
+    merchant_chargeback_woe[nb_transactions == 0] = np.nan
+
+    # Unknown and missing merchants
+    merchant_chargeback_woe[np.nan] = 0.
+
+    # Columns in order of appearance of the merchants sorted by weight,
+    # ties keep the order of appearance of the merchants in the data.
+    columns = {}
+    for _, weights in merchant_chargeback_woe.iterrows():
+        columns.update(dict.fromkeys(
+            weights.dropna().sort_values(kind='mergesort').index))
+    merchant_chargeback_woe = merchant_chargeback_woe[list(columns)]
+
+    # Row for the transactions without a valid weight of evidence
+    merchant_chargeback_woe = pd.concat([
+        merchant_chargeback_woe,
+        pd.DataFrame(
+            np.nan,
+            index=pd.Index([np.nan], name='timestamp'),
+            columns=merchant_chargeback_woe.columns)
+    ])
+    merchant_chargeback_woe.columns.name = None
+
+    return merchant_chargeback_woe
+
+
 def get_merchant_charback_woe(data, window_size=500):
     """Get the merchant charback weight of evidence.
 
@@ -213,6 +578,10 @@ def get_merchant_charback_woe(data, window_size=500):
 
     To prevent the model to be fitted use the valid window.
 
+    The per merchant counts are accumulated over the time windows, so the
+    cost grows with the number of transactions instead of the number of
+    windows times the number of transactions.
+
     Parameters
     -----------
     data : pandas.DataFrame
@@ -225,119 +594,765 @@ def get_merchant_charback_woe(data, window_size=500):
     merchant_chargeback_woe : pandas.DataFrame
         The merchants chargeback weight of evidence at a give timestamp.
     """
+    with instrumentation.span('group', rows=len(data)):
+        nb_fraud, nb_transactions = get_merchant_window_counts(
+            data,
+            window_size=window_size)
 
-    timestamps = data[
-        'timestamp'
-    ].apply(
-        lambda x: x - (x % window_size)
-    ).sort_values().drop_duplicates()
-
-    merchant_chargeback_woe, pbar = [], tqdm(total=len(timestamps))
-    for time in timestamps:
-        time_data = data[data['timestamp'] < time]
-
-        if time_data['Class'].sum() < 10:
-            continue
-
-        encoder = WOEEncoder(
-            cols=['merchant']
-        ).fit(
-            time_data['merchant'],
-            time_data['Class'])
-
-        merchant_encoder = encoder.mapping['merchant']
-        weights = pd.Series(
-            merchant_encoder.values,
-            index=encoder.ordinal_encoder.inverse_transform(
-                pd.DataFrame(
-                    {
-                        "merchant": merchant_encoder.index
-                    }
-                )
-            )['merchant'].tolist()
-        ).sort_values().to_dict()
-        weights['timestamp'] = time
-        merchant_chargeback_woe.append(weights)
-        pbar.update(1)
-
-    merchant_chargeback_woe = pd.DataFrame(
-        merchant_chargeback_woe
-    ).set_index('timestamp')
-
-    merchant_chargeback_woe = merchant_chargeback_woe.T
-    merchant_chargeback_woe[None] = np.nan
-    merchant_chargeback_woe = merchant_chargeback_woe.T
+    with instrumentation.span('woe', rows=len(nb_fraud)):
+        merchant_chargeback_woe = compute_merchant_woe(
+            nb_fraud,
+            nb_transactions)
 
     return merchant_chargeback_woe
 
 
-def process():
+def get_merchant_woe_asof(data, merchant_chargeback_woe):
+    """Get the merchant chargeback WOE valid at each transaction.
+
+    The valid WOE of a transaction is the one of the latest time window
+    strictly before the transaction timestamp, to prevent feature leak.
+
+    Parameters
+    -----------
+    data : pandas.DataFrame
+        The data, with the ``timestamp`` and ``merchant`` columns.
+    merchant_chargeback_woe : pandas.DataFrame
+        The output of ``get_merchant_charback_woe``.
+
+    Returns
+    -------
+    merchant_chargeback_woe : numpy.ndarray
+        The WOE of the merchant of each transaction, NaN when there is no
+        valid WOE.
+    """
+    woe_timestamps = merchant_chargeback_woe.index.to_numpy(dtype=float)
+    is_woe_timestamp = ~np.isnan(woe_timestamps)
+    woe_timestamps = woe_timestamps[is_woe_timestamp]
+    woe_values = merchant_chargeback_woe.to_numpy(
+        dtype=float)[is_woe_timestamp]
+
+    # As-of lookup, strictly before the transaction
+    timestamp = data['timestamp'].to_numpy(dtype=float)
+    woe_idx = np.searchsorted(woe_timestamps, timestamp, side='left') - 1
+    woe_idx[np.isnan(timestamp)] = -1
+
+    merchant_idx = merchant_chargeback_woe.columns.get_indexer(
+        data['merchant'])
+
+    is_valid = (woe_idx >= 0) & (merchant_idx >= 0)
+
+    woe = np.full(len(data), np.nan)
+    woe[is_valid] = woe_values[woe_idx[is_valid], merchant_idx[is_valid]]
+
+    return woe
+
+
+def compute_transaction_features_with_history(data, cards, card_merchants,
+                                              distance_method='geodesic'):
+    """Compute the transaction features given the credit cards history.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, newer than the history.
+    cards : pandas.DataFrame
+        The ``timestamp``, ``latitude``, ``longitude`` and ``merchant`` of
+        the last transaction of each ``credit_card_number`` in the history.
+    card_merchants : pandas.DataFrame
+        The last ``timestamp`` of each distinct ``credit_card_number`` and
+        ``merchant`` pair in the history.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+
+    Return
+    ------
+    cc_transaction_features : pandas.DataFrame
+        The data with the transaction features, indexed as ``data``.
+    """
+    cards = cards[cards['credit_card_number'].isin(
+        data['credit_card_number'])]
+    card_merchants = card_merchants[card_merchants['credit_card_number'].isin(
+        data['credit_card_number'])]
+
+    # The history is replayed as the last transaction of each card,
+    # preceded by the last transaction of the card at each merchant.
+    history = pd.concat([
+        card_merchants,
+        cards
+    ], ignore_index=True)
+
+    cc_transaction_features = compute_transaction_features(
+        pd.concat([
+            data[history.columns.tolist()],
+            history
+        ], ignore_index=True),
+        distance_method=distance_method
+    ).iloc[:len(data)]
+    cc_transaction_features.index = data.index
+
+    # Later transactions may follow, the first one of a card has no known
+    # merchant. A full rebuild differs on is_known_merchant, with NaN for
+    # the cards with a single transaction: it writes NaN where the first
+    # transaction of a card stays its only one, and False where the only
+    # transaction of a card written by an earlier process, NaN, is
+    # followed by the new data.
+    cc_transaction_features['is_known_merchant'] = cc_transaction_features[
+        'is_known_merchant'
+    ].fillna(False).astype(bool)
+
+    return cc_transaction_features
+
+
+def get_checkpoint():
+    """Get the state carried forward by the last process.
+
+    Returns
+    -------
+    checkpoint : dict
+        The ``watermark`` (latest processed timestamp), ``nb_rows``,
+        ``window_size`` and the DataFrames ``cards``, ``card_merchants``,
+        ``recent_transactions``, ``merchant_counts`` and
+        ``merchant_chargeback_woe`` (long format).
+        None if there is no checkpoint.
+    """
+    path = os.path.join(CHECKPOINT_DIR, 'checkpoint.json')
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        checkpoint = json.load(f)
+
+    for name in [
+            'cards', 'card_merchants', 'recent_transactions',
+            'merchant_counts', 'merchant_chargeback_woe']:
+        checkpoint[name] = pd.read_parquet(
+            os.path.join(CHECKPOINT_DIR, f'{name}.parquet'))
+
+    return checkpoint
+
+
+def save_checkpoint(checkpoint):
+    """Save the state carried forward to the next process.
+
+    Parameters
+    ----------
+    checkpoint : dict
+        The output of ``update_checkpoint``.
+    """
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+    for name in [
+            'cards', 'card_merchants', 'recent_transactions',
+            'merchant_counts', 'merchant_chargeback_woe']:
+        checkpoint[name].to_parquet(
+            os.path.join(CHECKPOINT_DIR, f'{name}.parquet'))
+
+    with open(os.path.join(CHECKPOINT_DIR, 'checkpoint.json'), 'w') as f:
+        json.dump({
+            'watermark': float(checkpoint['watermark']),
+            'nb_rows': int(checkpoint['nb_rows']),
+            'window_size': checkpoint['window_size']
+        }, f)
+
+
+def update_checkpoint(checkpoint, data, merchant_chargeback_woe,
+                      window_size=WINDOW_SIZE):
+    """Add processed transactions to the checkpoint.
+
+    Parameters
+    ----------
+    checkpoint : dict
+        The output of ``get_checkpoint``, None to start a new one.
+    data : pandas.DataFrame
+        The processed transactions, newer than the checkpoint.
+    merchant_chargeback_woe : pandas.DataFrame
+        The new time windows of the merchant chargeback WOE.
+    window_size : int
+        The time window size.
+
+    Returns
+    -------
+    checkpoint : dict
+        The updated checkpoint.
+    """
+    if checkpoint is None:
+        checkpoint = {
+            'watermark': -np.inf,
+            'nb_rows': 0,
+            'window_size': window_size,
+            'cards': None,
+            'card_merchants': None,
+            'recent_transactions': None,
+            'merchant_counts': None,
+            'merchant_chargeback_woe': None
+        }
+
+    cards = data[[
+        'credit_card_number', 'merchant', 'timestamp', 'latitude',
+        'longitude'
+    ]].astype({'latitude': float, 'longitude': float})
+    card_merchants = data[['credit_card_number', 'merchant', 'timestamp']]
+    recent_transactions = data[[
+        'credit_card_number', 'merchant', 'timestamp', 'Amount']]
+    merchant_counts = data.groupby('merchant', observed=True)['Class'].agg(
+        nb_fraud='sum',
+        nb_transactions='count')
+    merchant_chargeback_woe = merchant_chargeback_woe.loc[
+        merchant_chargeback_woe.index.notna(),
+        merchant_chargeback_woe.columns.notna()
+    ].rename_axis(
+        columns='merchant'
+    ).stack().dropna().rename('merchant_chargeback_woe').reset_index()
+
+    if checkpoint['cards'] is not None:
+        cards = pd.concat([checkpoint['cards'], cards], ignore_index=True)
+        card_merchants = pd.concat(
+            [checkpoint['card_merchants'], card_merchants],
+            ignore_index=True)
+        recent_transactions = pd.concat(
+            [checkpoint['recent_transactions'], recent_transactions],
+            ignore_index=True)
+        merchant_counts = merchant_counts.add(
+            checkpoint['merchant_counts'].set_index('merchant'),
+            fill_value=0
+        ).astype(int)
+        merchant_chargeback_woe = pd.concat(
+            [checkpoint['merchant_chargeback_woe'], merchant_chargeback_woe],
+            ignore_index=True)
+
+    watermark = max(checkpoint['watermark'], data['timestamp'].max())
+
+    checkpoint = dict(
+        checkpoint,
+        watermark=watermark,
+        nb_rows=checkpoint['nb_rows'] + len(data),
+        cards=cards.sort_values(
+            'timestamp', kind='mergesort'
+        ).drop_duplicates(
+            'credit_card_number', keep='last'
+        ).reset_index(drop=True),
+        card_merchants=card_merchants.sort_values(
+            'timestamp', kind='mergesort'
+        ).drop_duplicates(
+            ['credit_card_number', 'merchant'], keep='last'
+        ).reset_index(drop=True),
+        # Only the velocity windows of the next transactions are kept
+        recent_transactions=recent_transactions[
+            recent_transactions['timestamp'] >=
+            watermark - max(velocity.WINDOWS_MIN)
+        ].reset_index(drop=True),
+        merchant_counts=merchant_counts.reset_index(),
+        merchant_chargeback_woe=merchant_chargeback_woe)
+
+    return checkpoint
+
+
+class TransactionFeaturePipeline:
+    """Compute the credit card features of consecutive chunks of data.
+
+    The pipeline owns the state carried forward between chunks, the same
+    of the ``process`` checkpoint, and the row offset of the next chunk,
+    so it has no module-level state. Each chunk must be newer than the
+    previous ones. The state is guarded by a lock, so a pipeline can be
+    shared between threads, and independent pipelines, e.g. one per
+    partition, run concurrently.
+
+    Parameters
+    ----------
+    window_size : int
+        The time window size of the merchant chargeback WOE.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+    n_jobs : int
+        The number of worker processes of the transaction features of
+        ``fit_transform``, None to use all the CPUs.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import creditcard
+        from fraud_prevention.features import cc_transaction_features
+
+        data = creditcard.get()
+        is_history = data['timestamp'] <= 86400
+
+        pipeline = cc_transaction_features.TransactionFeaturePipeline()
+        pipeline.fit(data[is_history])
+
+        dataset = pipeline.transform(data[~is_history])
+    """
+
+    def __init__(self, window_size=WINDOW_SIZE, distance_method='geodesic',
+                 n_jobs=1):
+        self.window_size = window_size
+        self.distance_method = distance_method
+        self.n_jobs = n_jobs
+        self.checkpoint = None
+
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_checkpoint(cls, checkpoint, **kwargs):
+        """Build the pipeline from a checkpoint.
+
+        Parameters
+        ----------
+        checkpoint : dict
+            The output of ``get_checkpoint``.
+
+        Returns
+        -------
+        pipeline : TransactionFeaturePipeline
+            The fitted pipeline.
+        """
+        pipeline = cls(window_size=checkpoint['window_size'], **kwargs)
+        pipeline.checkpoint = checkpoint
+
+        return pipeline
+
+    def fit(self, data):
+        """Fit the pipeline state to the transaction history.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The transaction history.
+
+        Returns
+        -------
+        self : TransactionFeaturePipeline
+            The fitted pipeline.
+        """
+        self.fit_transform(data)
+
+        return self
+
+    def fit_transform(self, data):
+        """Compute the features of the transaction history and fit the
+        pipeline state to it.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The transaction history.
+
+        Returns
+        -------
+        dataset : pandas.DataFrame
+            The data with the features, with the ``data`` index as column.
+        """
+        # Add transactional features
+        with instrumentation.span('per_card_features', rows=len(data)):
+            cc_transaction_features = compute_transaction_features_parallel(
+                data,
+                n_jobs=self.n_jobs,
+                distance_method=self.distance_method,
+                verbose=False)
+
+        with instrumentation.span('velocity_features', rows=len(data)):
+            velocity_features = velocity.compute_velocity_features(data)
+
+        with instrumentation.span('merge', rows=len(data)):
+            trasaction_features = pd.concat(
+                [cc_transaction_features, velocity_features],
+                axis=1)
+            trasaction_features.reset_index(inplace=True)
+
+            dataset = data.reset_index().merge(
+                trasaction_features,
+                how='left',
+                on=['index'])
+
+        # Add temporal features
+        with instrumentation.span('merchant_chargeback_woe', rows=len(data)):
+            merchant_chargeback_woe = get_merchant_charback_woe(
+                data,
+                window_size=self.window_size)
+
+        # Get the valid WOE closest to the timestamp
+        with instrumentation.span('woe_asof', rows=len(dataset)):
+            dataset['merchant_chargeback_woe'] = get_merchant_woe_asof(
+                dataset,
+                merchant_chargeback_woe)
+
+        with self._lock:
+            self.checkpoint = update_checkpoint(
+                None,
+                data,
+                merchant_chargeback_woe,
+                window_size=self.window_size)
+
+        return dataset
+
+    def transform(self, data, update=True):
+        """Compute the features of new transactions.
+
+        The history is the pipeline state, the cost is proportional to
+        the new data. The rows are numbered after the ones already seen.
+        A ``ValueError`` is raised for chunks with transactions at or
+        before the latest one seen, e.g. replayed or out of order chunks,
+        whose history would already hold their future.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The new transactions, newer than the ones already seen.
+        update : bool
+            Set to False prevents adding the transactions to the state.
+
+        Returns
+        -------
+        dataset : pandas.DataFrame
+            The data with the features, with the row numbers as ``index``
+            column.
+        """
+        with self._lock:
+            checkpoint = self.checkpoint
+            if checkpoint is None:
+                raise ValueError('The pipeline is not fitted, call fit().')
+            if data['timestamp'].min() <= checkpoint['watermark']:
+                raise ValueError(
+                    f"The transactions from {data['timestamp'].min()} are "
+                    f"not newer than the watermark {checkpoint['watermark']}"
+                    ', chunks must be in time order.')
+
+            dataset, merchant_chargeback_woe = self._transform(
+                data,
+                checkpoint)
+
+            if update:
+                self.checkpoint = update_checkpoint(
+                    checkpoint,
+                    data,
+                    merchant_chargeback_woe,
+                    window_size=self.window_size)
+
+        return dataset
+
+    def _transform(self, data, checkpoint):
+        # Row numbers following the processed transactions
+        data = data.set_axis(pd.RangeIndex(
+            checkpoint['nb_rows'],
+            checkpoint['nb_rows'] + len(data)))
+
+        # Add transactional features
+        with instrumentation.span('per_card_features', rows=len(data)):
+            cc_transaction_features = (
+                compute_transaction_features_with_history(
+                    data,
+                    cards=checkpoint['cards'],
+                    card_merchants=checkpoint['card_merchants'],
+                    distance_method=self.distance_method))
+
+        with instrumentation.span('velocity_features', rows=len(data)):
+            velocity_features = (
+                velocity.compute_velocity_features_with_history(
+                    data,
+                    history=checkpoint['recent_transactions']))
+
+        dataset = pd.concat(
+            [data, cc_transaction_features, velocity_features],
+            axis=1
+        ).reset_index()
+
+        # Add temporal features, counting the transactions of the checkpoint
+        with instrumentation.span('group', rows=len(data)):
+            nb_fraud, nb_transactions = get_merchant_window_counts(
+                data,
+                window_size=self.window_size)
+
+        last_window = checkpoint['watermark'] - (
+            checkpoint['watermark'] % self.window_size)
+        is_new_window = nb_fraud.index > last_window
+
+        merchant_counts = checkpoint['merchant_counts'].set_index('merchant')
+        merchants = merchant_counts.index.union(nb_fraud.columns, sort=False)
+
+        nb_fraud = nb_fraud[is_new_window].reindex(
+            columns=merchants,
+            fill_value=0
+        ) + merchant_counts['nb_fraud'].reindex(merchants, fill_value=0)
+        nb_transactions = nb_transactions[is_new_window].reindex(
+            columns=merchants,
+            fill_value=0
+        ) + merchant_counts['nb_transactions'].reindex(
+            merchants,
+            fill_value=0)
+
+        with instrumentation.span('woe', rows=len(nb_fraud)):
+            merchant_chargeback_woe = compute_merchant_woe(
+                nb_fraud,
+                nb_transactions)
+
+        # Get the valid WOE closest to the timestamp
+        with instrumentation.span('woe_asof', rows=len(dataset)):
+            dataset['merchant_chargeback_woe'] = get_merchant_woe_asof(
+                dataset,
+                pd.concat([
+                    checkpoint['merchant_chargeback_woe'].pivot(
+                        index='timestamp',
+                        columns='merchant',
+                        values='merchant_chargeback_woe'),
+                    merchant_chargeback_woe
+                ]))
+
+        return dataset, merchant_chargeback_woe
+
+
+@instrumentation.instrument('cc_transaction_features.process')
+def process(append=False, n_jobs=1):
     """Process the credit card features.
+
+    Parameters
+    ----------
+    append : bool
+        Set to True processes only the transactions newer than the
+        checkpoint watermark, carrying forward the per credit card state
+        and the merchant counts of the checkpoint. The new transactions
+        are written to new files in the partitions of ``PATH``.
+    n_jobs : int
+        The number of worker processes of the transaction features of the
+        full process, None to use all the CPUs.
+    """
+    if append:
+        return process_append()
+
+    with instrumentation.span('load') as span:
+        data = creditcard.get()
+        span.rows = len(data)
+
+    pipeline = TransactionFeaturePipeline(n_jobs=n_jobs)
+    dataset = pipeline.fit_transform(data)
+
+    # The full process supersedes the incremental updates
+    with instrumentation.span('write', rows=len(dataset)):
+        storage.remove(PATH)
+        storage.write_partitioned(
+            schema.apply(dataset, schema.CC_TRANSACTION_FEATURES_DTYPES),
+            PATH)
+
+    with instrumentation.span('checkpoint'):
+        save_checkpoint(pipeline.checkpoint)
+
+
+@instrumentation.instrument('cc_transaction_features.process_append')
+def process_append():
+    """Process the credit card features of the new transactions.
+
+    Only the transactions newer than the checkpoint watermark are read and
+    processed, so the cost is proportional to the new data. The source
+    transactions at or before the watermark not yet processed, e.g. late
+    or tied with the watermark, are skipped with a warning, a full
+    ``process()`` includes them.
+    """
+    with instrumentation.span('load') as span:
+        checkpoint = get_checkpoint()
+        if checkpoint is None:
+            raise ValueError('There is no checkpoint, run process() first.')
+
+        data = creditcard.get(
+            filters=[('timestamp', '>', checkpoint['watermark'])])
+        span.rows = len(data)
+
+        nb_late = len(storage.read(
+            creditcard.PATH,
+            columns=['timestamp'],
+            filters=[('timestamp', '<=', checkpoint['watermark'])]
+        )) - checkpoint['nb_rows']
+        if nb_late > 0:
+            LOGGER.warning(
+                'Skipped %d transactions at or before the watermark %s, '
+                'run process() to include them.',
+                nb_late,
+                checkpoint['watermark'])
+
+    if len(data) == 0:
+        return
+
+    pipeline = TransactionFeaturePipeline.from_checkpoint(checkpoint)
+    dataset = pipeline.transform(data)
+
+    # Named after the first row number, after the files of the partitions
+    with instrumentation.span('write', rows=len(dataset)):
+        storage.write_partitioned(
+            schema.apply(dataset, schema.CC_TRANSACTION_FEATURES_DTYPES),
+            PATH,
+            basename=f'part-{dataset["index"].iloc[0]:012d}')
+
+    with instrumentation.span('checkpoint'):
+        save_checkpoint(pipeline.checkpoint)
+
+
+def get_paths():
+    """Get the parquet files of the dataset.
+
+    Returns
+    -------
+    paths : list[str]
+        The parquet files, in time order.
+    """
+    return storage.get_files(PATH)
+
+
+def get_filters(start=None, end=None):
+    """Get the parquet row filters of a timestamp range.
+
+    Parameters
+    ----------
+    start : float
+        The range start, exclusive. None for no lower bound.
+    end : float
+        The range end, inclusive. None for no upper bound.
+
+    Returns
+    -------
+    filters : list[tuple]
+        The ``pandas.read_parquet`` row filters, None for no range.
     """
-    global DATA_GRP
-
-    data = creditcard.get()
-
-    cc_numbers = data['credit_card_number'].value_counts().index
-    DATA_GRP = data.groupby('credit_card_number')
-
-    # Add transactional features
-    trasaction_features = apply_threading(
-        func=process_cc_features,
-        data=cc_numbers,
-        verbose=True)
-
-    trasaction_features = pd.concat(trasaction_features, axis=0)
-    trasaction_features.reset_index(inplace=True)
-
-    dataset = data.reset_index().merge(
-        trasaction_features,
-        how='left',
-        on=['index'])
-
-    # Add temporal features
-    merchant_chargeback_woe = get_merchant_charback_woe(
-        data,
-        window_size=500)
-
-    # Get the valid WOE closest to the timestamp
-    woe_valid_idx = []
-    for t in dataset['timestamp']:
-        woe_not_feature_leak = (
-            merchant_chargeback_woe.index < t
-        )  # Ensure not doing feature leak
-
-        if woe_not_feature_leak.sum() == 0:
-            woe_valid_idx.append(None)
-        else:
-            woe_valid_idx.append(
-                merchant_chargeback_woe.index[
-                    woe_not_feature_leak
-                ].max()
-            )
-    dataset['merchant_chargeback_woe'] = [
-        woe[m]
-        for woe, m in zip(
-            merchant_chargeback_woe.loc[
-                pd.Series(woe_valid_idx)
-            ].to_dict('records'),
-            dataset['merchant'].tolist())]
-
-    dataset.to_parquet(PATH)
-
-
-def get():
+    filters = []
+    if start is not None:
+        filters.append(('timestamp', '>', start))
+    if end is not None:
+        filters.append(('timestamp', '<=', end))
+
+    return filters if filters else None
+
+
+def get(columns=None, start=None, end=None):
     """Get the dataset.
 
+    The column projection and the timestamp range are pushed down to the
+    parquet reader, only the columns and row groups needed are read.
+
+    Parameters
+    ----------
+    columns : list[str]
+        The columns to read, by default all of them.
+    start : float
+        Read the transactions with a timestamp greater than ``start``.
+    end : float
+        Read the transactions with a timestamp lower or equal than
+        ``end``.
+
     Returns
     --------
     data : pandas.DataFrame
         The data.
-    """
 
-    data = pd.read_parquet(PATH)
+    Example
+    -------
+    ::
 
-    data['latitude'] = data['latitude'].astype(float)
-    data['longitude'] = data['longitude'].astype(float)
+        from fraud_prevention.features import cc_transaction_features
+
+        # The last 10% of time
+        data = cc_transaction_features.get(
+            columns=['timestamp', 'merchant', 'Class'],
+            start=cc_transaction_features.get_timestamp_quantile(.9))
+    """
+    data = storage.read(
+        PATH,
+        columns=columns,
+        filters=get_filters(start=start, end=end))
 
     return data
+
+
+def get_timestamp_quantile(q, start=None, end=None):
+    """Get a quantile of the dataset timestamps.
+
+    Same as ``get(start=start, end=end)['timestamp'].quantile(q)``, but
+    reading only the row groups that may hold the quantile according to
+    their timestamp statistics. As the data is in time order, that is
+    usually one row group.
+
+    Parameters
+    ----------
+    q : float
+        The quantile, between 0 and 1.
+    start : float
+        The range start, exclusive. None for no lower bound.
+    end : float
+        The range end, inclusive. None for no upper bound.
+
+    Returns
+    -------
+    quantile : float
+        The timestamp quantile, with linear interpolation.
+    """
+    start = -np.inf if start is None else start
+    end = np.inf if end is None else end
+
+    def read_timestamps(parquet_file, row_group):
+        timestamp = parquet_file.read_row_group(
+            row_group,
+            columns=['timestamp']
+        ).column('timestamp').to_numpy()
+        timestamp = timestamp[(timestamp > start) & (timestamp <= end)]
+
+        return timestamp[~np.isnan(timestamp)]
+
+    # Row groups fully in the range, and timestamps of the ones partially
+    row_groups, known = [], []
+    for path in get_paths():
+        parquet_file = pq.ParquetFile(path)
+        column = parquet_file.schema_arrow.names.index('timestamp')
+
+        for i in range(parquet_file.num_row_groups):
+            metadata = parquet_file.metadata.row_group(i)
+            stats = metadata.column(column).statistics
+
+            if stats is None or not stats.has_min_max or stats.null_count:
+                known.append(read_timestamps(parquet_file, i))
+            elif stats.max <= start or stats.min > end:
+                continue
+            elif stats.min > start and stats.max <= end:
+                row_groups.append((
+                    parquet_file, i, stats.min, stats.max,
+                    metadata.num_rows))
+            else:
+                known.append(read_timestamps(parquet_file, i))
+
+    known = np.concatenate([np.empty(0)] + known)
+    ts_min, ts_max, nb_rows = (
+        np.array([row_group[k] for row_group in row_groups], dtype=float)
+        for k in [2, 3, 4])
+
+    total_rows = len(known) + int(nb_rows.sum())
+    if total_rows == 0:
+        return np.nan
+
+    rank = q * (total_rows - 1)
+    lower, upper = int(np.floor(rank)), int(np.ceil(rank))
+
+    # Bounds of the values at the ranks, the known values are row groups
+    # of a single row.
+    ts_min = np.concatenate([ts_min, known])
+    ts_max = np.concatenate([ts_max, known])
+    nb_rows = np.concatenate([nb_rows, np.ones(len(known))])
+
+    order = np.argsort(ts_min, kind='mergesort')
+    lower_bound = ts_min[order][
+        np.searchsorted(np.cumsum(nb_rows[order]), lower + 1)]
+    order = np.argsort(ts_max, kind='mergesort')
+    upper_bound = ts_max[order][
+        np.searchsorted(np.cumsum(nb_rows[order]), upper + 1)]
+
+    # Read the row groups overlapping the bounds, the rest is before or
+    # after the ranks.
+    nb_before = 0
+    for parquet_file, i, group_min, group_max, group_rows in row_groups:
+        if group_max < lower_bound:
+            nb_before += group_rows
+        elif group_min <= upper_bound:
+            known = np.concatenate([
+                known,
+                read_timestamps(parquet_file, i)])
+
+    known = np.sort(known)
+    lower_value = known[lower - nb_before]
+    upper_value = known[upper - nb_before]
+
+    return lower_value + (upper_value - lower_value) * (rank - lower)
@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import os
-import random
+import itertools
 
-from tqdm import tqdm
+import numpy as np
 import pandas as pd
-from faker import Faker
+import pyarrow as pa
+import pyarrow.parquet as pq
+from faker.providers.geo import Provider as GeoProvider
 
 from fraud_prevention.data import creditcard
+from fraud_prevention.features import schema
+from fraud_prevention.features import storage
 from fraud_prevention import config
+from fraud_prevention import instrumentation
 
 
+# Partitioned by time bucket, see ``features.storage``
 PATH = os.path.join(
     config.PRJ_DIR,
     'data/processed/credit_card.parquet')
 
-FAKER = Faker()
-
 NON_FRAUDSTERS_LOCATION = [
     'MX',  # Mexico
     'US',  # USA
@@ -57,9 +61,15 @@ FRAUDSTERS_MERCHANTS = (
 ) + (['store_2'] * 10) + (['restaurant_2'] * 10) + (['fligh_tickets'] * 30)
 
 
-def get():
+def get(filters=None):
     """Get the dataset.
 
+    Parameters
+    -----------
+    filters : list[tuple]
+        The ``pandas.read_parquet`` row filters, e.g.
+        ``[('timestamp', '>', 1000.)]``.
+
     Returns
     --------
     data : pandas.DataFrame
@@ -113,28 +123,217 @@ def get():
         Name: 0, dtype: object
 
     """
-    data = pd.read_parquet(PATH)
+    data = storage.read(PATH, filters=filters)
 
     return data
 
 
-def process():
+@instrumentation.instrument('creditcard.process')
+def process(seed=None):
     """Add synthetic data.
+
+    Parameters
+    -----------
+    seed : int
+        The random seed of the synthetic data.
+    """
+    with instrumentation.span('load') as span:
+        data = creditcard.get()
+        span.rows = len(data)
+
+    with instrumentation.span('write', rows=len(data)):
+        storage.remove(PATH)
+        write_synthetic_fraud(
+            data,
+            path=PATH,
+            max_group_size=7,
+            partition_size=storage.PARTITION_SIZE,
+            seed=seed)
+
+
+def get_country_coordinates(country_codes):
+    """Get the known land coordinates of the countries.
+
+    The coordinates are the ones used by ``Faker.local_latlng``.
+
+    Parameters
+    -----------
+    country_codes : list[str]
+        The country codes.
+
+    Returns
+    -------
+    country_coordinates : dict[str, numpy.ndarray]
+        The latitude and longitude of the locations of each country, as an
+        array with one row per location.
+    """
+    country_coordinates = {}
+    for country_code in set(country_codes):
+        coordinates = [
+            (float(lat), float(lon))
+            for lat, lon, _, code, _ in GeoProvider.land_coords
+            if code == country_code
+        ]
+
+        if len(coordinates) == 0:
+            raise ValueError(f'No known locations for {country_code}')
+
+        country_coordinates[country_code] = np.array(coordinates)
+
+    return country_coordinates
+
+
+def _choice(rng, values, size):
+    values = np.asarray(values)
+    return values[rng.integers(len(values), size=size)]
+
+
+def iter_synthetic_fraud(data, max_group_size=7, chunk_size=1_000_000,
+                         seed=None):
+    """Generate the synthetic data in chunks.
+
+    Vectorized generator of the synthetic data added by
+    ``get_synthetic_fraud``. The consecutive transactions of ``data`` are
+    split in groups of 3 to ``max_group_size`` transactions (the first one
+    of 2 to ``max_group_size``) sharing a credit card. Each chunk draws
+    its group sizes, time deltas, countries, merchants and geolocations
+    at once, the group in progress at the end of a chunk carries over to
+    the next one.
+
+    Parameters
+    -----------
+    data : pandas.DataFrame
+        The data, with the ``Time`` and ``Class`` columns.
+    max_group_size : int
+        The number of max transactions per credit card.
+    chunk_size : int
+        The number of transactions per chunk.
+    seed : int
+        The random seed.
+
+    Yields
+    ------
+    data_synthetic : pandas.DataFrame
+        The synthetic data of the next ``chunk_size`` transactions.
     """
-    data = creditcard.get()
-    data_synthetic = get_synthetic_fraud(
-        data,
-        max_group_size=7)
+    chunks = (
+        data.iloc[start:start + chunk_size]
+        for start in range(0, len(data), chunk_size))
+
+    yield from _iter_synthetic_fraud(
+        chunks,
+        max_group_size=max_group_size,
+        rng=np.random.default_rng(seed))
+
+
+def _iter_synthetic_fraud(chunks, max_group_size, rng):
+    country_coordinates = get_country_coordinates(
+        FRAUDSTERS_LOCATION + NON_FRAUDSTERS_LOCATION)
+    country_codes = list(country_coordinates)
+
+    fraudsters_location = [
+        country_codes.index(c) for c in FRAUDSTERS_LOCATION]
+    non_fraudsters_location = [
+        country_codes.index(c) for c in NON_FRAUDSTERS_LOCATION]
+
+    # The group in progress: rows left, credit card and last timestamp
+    group_left, credit_card_number, timestamp = 0, 0, 0.
+    is_first_group = True
+
+    for chunk in chunks:
+        n_rows = len(chunk)
+
+        # Credit card groups
+        group_sizes = rng.integers(
+            3, max_group_size + 1, size=n_rows // 3 + 1)
+        if is_first_group:
+            group_sizes[0] = rng.integers(2, max_group_size + 1)
+            is_first_group = False
+
+        group_starts = group_left + np.concatenate([
+            [0],
+            np.cumsum(group_sizes)[:-1]])
+        is_group_start = group_starts < n_rows
+        group_starts = group_starts[is_group_start]
+        group_sizes = group_sizes[is_group_start]
+
+        is_start = np.zeros(n_rows, dtype=bool)
+        is_start[group_starts] = True
+        group_id = np.cumsum(is_start)
+
+        # Rows before the first group start continue the previous group
+        group_credit_card_number = np.concatenate([
+            [credit_card_number],
+            rng.integers(
+                4_000_000_000_000_000,
+                5_000_000_000_000_000,
+                size=len(group_starts))
+        ])
+
+        is_fraud = chunk['Class'].to_numpy() == 1
+        n_fraud = is_fraud.sum()
 
-    data = pd.concat([
-        data_synthetic.reset_index(drop=True),
-        data.drop(['Time'], axis=1).reset_index(drop=True)
-    ], axis=1)
+        # Create timestamps
+        timestamp_delta = np.empty(n_rows)
+        timestamp_delta[is_fraud] = _choice(
+            rng, FRAUDSTERS_TIME_DISTANCE_MIN, n_fraud)
+        timestamp_delta[~is_fraud] = _choice(
+            rng, NON_FRAUDSTERS_TIME_DISTANCE_MIN, n_rows - n_fraud)
+        timestamp_delta[is_start] = 0
+        elapsed_time = np.cumsum(timestamp_delta)
+
+        group_timestamp = np.concatenate([
+            [timestamp],
+            chunk['Time'].to_numpy(dtype=float)[group_starts]])
+        group_elapsed_time = np.concatenate([
+            [0.],
+            elapsed_time[group_starts]])
+
+        chunk_timestamp = (
+            group_timestamp[group_id] + (
+                elapsed_time - group_elapsed_time[group_id]))
+
+        # Create countries and merchants
+        country = np.empty(n_rows, dtype=int)
+        country[is_fraud] = _choice(rng, fraudsters_location, n_fraud)
+        country[~is_fraud] = _choice(
+            rng, non_fraudsters_location, n_rows - n_fraud)
+
+        merchant = np.empty(n_rows, dtype=object)
+        merchant[is_fraud] = _choice(rng, FRAUDSTERS_MERCHANTS, n_fraud)
+        merchant[~is_fraud] = _choice(
+            rng, NON_FRAUDSTERS_MERCHANTS, n_rows - n_fraud)
 
-    data.to_parquet(PATH)
+        # Create geolocations
+        geolocation = np.empty((n_rows, 2))
+        for i, country_code in enumerate(country_codes):
+            is_country = country == i
+            geolocation[is_country] = _choice(
+                rng,
+                country_coordinates[country_code],
+                is_country.sum())
+
+        yield pd.DataFrame({
+            "credit_card_number": group_credit_card_number[group_id],
+            "latitude": geolocation[:, 0],
+            "longitude": geolocation[:, 1],
+            "timestamp": chunk_timestamp,
+            "merchant": pd.Categorical(
+                merchant,
+                categories=pd.unique(np.array(
+                    NON_FRAUDSTERS_MERCHANTS + FRAUDSTERS_MERCHANTS)))
+        })
 
+        # Carry the group in progress over to the next chunk
+        if len(group_starts) > 0:
+            group_left = group_starts[-1] + group_sizes[-1] - n_rows
+        else:
+            group_left -= n_rows
+        credit_card_number = group_credit_card_number[-1]
+        timestamp = chunk_timestamp[-1]
 
-def get_synthetic_fraud(data, max_group_size=7):
+
+def get_synthetic_fraud(data, max_group_size=7, seed=None):
     """Function to generate synthetic dataset.
 
     The following synthetic data is added to the original data:
@@ -149,6 +348,8 @@ def get_synthetic_fraud(data, max_group_size=7):
         The data.
     max_group_size : int
         The number of max transactions per credit card.
+    seed : int
+        The random seed.
 
     Returns
     -------
@@ -156,56 +357,108 @@ def get_synthetic_fraud(data, max_group_size=7):
         The data.
 
     """
+    dataset = pd.concat(
+        iter_synthetic_fraud(
+            data,
+            max_group_size=max_group_size,
+            seed=seed),
+        ignore_index=True)
 
-    synthetic_data = []
-    local_group_size = 0
-
-    group_size = random.choice(range(2, max_group_size + 1))
-
-    pbar = tqdm(total=len(data))
-    for _, row in data.iterrows():
-        is_fraud = row['Class'] == 1
-
-        if local_group_size >= group_size:
-            local_group_size = 0
-            group_size = random.choice(range(3, max_group_size + 1))
+    return dataset
 
-        # Create credit card number
-        if local_group_size == 0:
-            credit_card_number = FAKER.credit_card_number()
 
-        # Create timestamps
-        if is_fraud:
-            timestamp_delta = random.choice(FRAUDSTERS_TIME_DISTANCE_MIN)
-            country_code = random.choice(FRAUDSTERS_LOCATION)
-            merchant = random.choice(FRAUDSTERS_MERCHANTS)
-        else:
-            timestamp_delta = random.choice(NON_FRAUDSTERS_TIME_DISTANCE_MIN)
-            country_code = random.choice(NON_FRAUDSTERS_LOCATION)
-            merchant = random.choice(NON_FRAUDSTERS_MERCHANTS)
+def write_synthetic_fraud(data, path, n_rows=None, max_group_size=7,
+                          chunk_size=1_000_000, partition_size=None,
+                          seed=None):
+    """Write the data with the synthetic data added to a parquet file.
 
-        if local_group_size == 0:
-            timestamp = row['Time']
-        else:
-            timestamp = timestamp + timestamp_delta
+    The file is written one row group per chunk, so the memory use is
+    bounded by ``chunk_size`` and not by ``n_rows``. With a
+    ``partition_size``, ``path`` is instead a folder partitioned by time
+    bucket, see ``features.storage``, and the memory use is bounded by the
+    chunk and partition sizes.
 
-        # Create geolocations
-        lat, lon = FAKER.local_latlng(
-            country_code=country_code,
-            coords_only=True)
-
-        synthetic_data.append({
-            "credit_card_number": credit_card_number,
-            "latitude": lat,
-            "longitude": lon,
-            "timestamp": timestamp,
-            "merchant": merchant
-        })
+    Parameters
+    -----------
+    data : pandas.DataFrame
+        The data.
+    path : str
+        The parquet file path.
+    n_rows : int
+        The number of transactions to write, by default the ones in
+        ``data``. Larger sizes repeat ``data`` shifting its ``Time`` after
+        the previous repetition, useful to generate load test datasets.
+    max_group_size : int
+        The number of max transactions per credit card.
+    chunk_size : int
+        The number of transactions per row group.
+    partition_size : int
+        The timestamp units per partition, None to write a single file.
+    seed : int
+        The random seed.
 
-        local_group_size += 1
-        pbar.update(1)
+    Example
+    -------
+    ::
 
-    # Convert to pandas DataFrame
-    dataset = pd.DataFrame(synthetic_data)
+        from fraud_prevention.data import creditcard as creditcard_data
+        from fraud_prevention.features import creditcard
 
-    return dataset
+        creditcard.write_synthetic_fraud(
+            creditcard_data.get(),
+            path='/tmp/credit_card_100M.parquet',
+            n_rows=100_000_000,
+            seed=42)
+    """
+    if n_rows is None:
+        n_rows = len(data)
+
+    data = data.reset_index(drop=True)
+    time_period = data['Time'].max() + 1
+
+    def iter_chunks():
+        for start in range(0, n_rows, chunk_size):
+            idx = np.arange(start, min(start + chunk_size, n_rows))
+            chunk = data.iloc[idx % len(data)].reset_index(drop=True)
+            chunk['Time'] += (idx // len(data)) * time_period
+            yield chunk
+
+    chunks, chunks_synthetic = itertools.tee(iter_chunks())
+    data_synthetic = _iter_synthetic_fraud(
+        chunks_synthetic,
+        max_group_size=max_group_size,
+        rng=np.random.default_rng(seed))
+
+    writer, table_schema = None, None
+    for i, (chunk, chunk_synthetic) in enumerate(
+            zip(chunks, data_synthetic)):
+        chunk = schema.apply(
+            pd.concat([
+                chunk_synthetic,
+                chunk.drop(['Time'], axis=1)
+            ], axis=1),
+            schema.CREDIT_CARD_DTYPES)
+
+        if partition_size is not None:
+            storage.write_partitioned(
+                chunk,
+                path,
+                basename=f'part-{i:012d}',
+                partition_size=partition_size)
+            continue
+
+        table = pa.Table.from_pandas(
+            chunk,
+            schema=table_schema,
+            preserve_index=False)
+        if writer is None:
+            table_schema = table.schema
+            writer = pq.ParquetWriter(path, table_schema)
+        writer.write_table(table, row_group_size=chunk_size)
+
+    if writer is not None:
+        writer.close()
+
+    # Chunks may span several partitions, one sorted file per partition
+    if partition_size is not None:
+        storage.compact(path)
@@ -1,12 +1,135 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
+import os
+import json
+import uuid
+import shutil
+import hashlib
+
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
+from fraud_prevention import config
+from fraud_prevention.features import velocity
 from fraud_prevention.features import cc_transaction_features
 
+# The model features, in the model input column order
+FEATURES = [
+    f'V{i}' for i in range(1, 29)
+] + [
+    'Amount',
+    'time_prev_transaction',
+    'km_dist_prev_transaction',
+    'merchant_chargeback_woe',
+    'is_known_merchant',
+    'nb_known_merchants',
+    'time_prev_merchant_transaction'
+] + velocity.get_feature_names()
+
+# Memory-mapped split matrices, one folder per ``get`` arguments
+CACHE_DIR = os.path.join(
+    config.PRJ_DIR,
+    'data/interim/dataset_cache')
+
+SPLITS = ['train', 'test', 'val']
+
+# Part of the cache key, bumped when the cached splits change
+CACHE_VERSION = 2
+
+OUTLIER_BOUNDS_PATH = os.path.join(
+    config.PRJ_DIR,
+    'models/outlier_bounds.parquet')
+
+
+def fit_outlier_bounds(data, features, quantiles=(.01, .99)):
+    """Fit the outlier bounds of the features.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data.
+    features : list[str]
+        The features.
+    quantiles : Tuple(float, float)
+        The quantiles of the lower and upper bounds.
+
+    Returns
+    -------
+    bounds : pandas.DataFrame
+        The ``lower`` and ``upper`` bounds (index) of each feature
+        (columns), NaN for the features without values.
+    """
+    X = data[features].to_numpy(dtype=float)
+
+    # All the quantiles at once, missing values are skipped
+    if len(X) > 0:
+        bounds = np.nanquantile(X, sorted(quantiles), axis=0)
+    else:
+        bounds = np.full((2, len(features)), np.nan)
+
+    bounds = pd.DataFrame(
+        bounds,
+        index=['lower', 'upper'],
+        columns=features)
+
+    return bounds
+
+
+def save_outlier_bounds(bounds, path=OUTLIER_BOUNDS_PATH):
+    """Save the outlier bounds.
+
+    Parameters
+    ----------
+    bounds : pandas.DataFrame
+        The output of ``fit_outlier_bounds``.
+    path : str
+        The parquet file path.
+    """
+    bounds.to_parquet(path)
+
+
+def load_outlier_bounds(path=OUTLIER_BOUNDS_PATH):
+    """Load the outlier bounds.
+
+    Parameters
+    ----------
+    path : str
+        The parquet file path.
+
+    Returns
+    -------
+    bounds : pandas.DataFrame
+        The output of ``fit_outlier_bounds``.
+    """
+    return pd.read_parquet(path)
+
+
+def is_outlier(data, bounds):
+    """Flag the transactions with any feature out of the bounds.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data.
+    bounds : pandas.DataFrame
+        The output of ``fit_outlier_bounds``.
+
+    Returns
+    -------
+    is_outlier : numpy.ndarray
+        True for the transactions with a feature lower than its lower
+        bound or greater than its upper bound. Missing values and bounds
+        are never out of the bounds.
+    """
+    X = data[bounds.columns].to_numpy(dtype=float)
+    lower, upper = bounds.loc[['lower', 'upper']].to_numpy(dtype=float)
 
-def remove_neg_class_outliers(data, features):
+    # (n, features) masks, broadcasting the bounds over the rows
+    return ((X < lower) | (X > upper)).any(axis=1)
+
+
+def remove_neg_class_outliers(data, features, bounds=None):
     """Remove outliers in the negative class.
 
     Parameters
@@ -15,43 +138,67 @@ def remove_neg_class_outliers(data, features):
         The data.
     features : list[str]
         The features.
+    bounds : pandas.DataFrame
+        The output of ``fit_outlier_bounds``, e.g. the persisted bounds
+        of the training data. By default, fitted to ``data``.
 
     Returns
     -------
     data : pandas.DataFrame
         The data with outliers removed.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import dataset
+
+        bounds = dataset.fit_outlier_bounds(train_data, dataset.FEATURES)
+        dataset.save_outlier_bounds(bounds)
+
+        train_data = dataset.remove_neg_class_outliers(
+            train_data,
+            dataset.FEATURES,
+            bounds=dataset.load_outlier_bounds())
     """
-    # Remove outliers
-    is_f_outlier_cnt = []
-    for f in features:
-        min_val, max_val = data[f].quantile([
-            .01,
-            .99
-        ]).sort_index().tolist()
-
-        is_f_outlier = (
-            (
-                data[f] < min_val
-            ) | (
-                data[f] > max_val
-            )
-        ) & (
-            data['Class'] == 0
-        )
-
-        is_f_outlier_cnt.append(is_f_outlier)
-
-    is_f_outlier_cnt = pd.DataFrame(is_f_outlier_cnt).T.sum(axis=1)
-    is_not_outlier = (is_f_outlier_cnt == 0)
-
-    data = data[is_not_outlier]
+    if bounds is None:
+        bounds = fit_outlier_bounds(data, features)
+
+    is_neg_outlier = is_outlier(
+        data,
+        bounds[features]
+    ) & (data['Class'].to_numpy() == 0)
+
+    data = data[~is_neg_outlier]
 
     return data
 
 
-def get(val_size=.1, test_size=0.3):
+def get(val_size=.1, test_size=0.3, features=None, start=None, end=None,
+        cache=False):
     """Get the dataset.
 
+    Only the ``features`` columns and the rows in the timestamp range are
+    read. The out-of-time test partition threshold is computed from the
+    parquet row group statistics, and each partition is read with the
+    threshold pushed down to the parquet reader.
+
+    Parameters
+    ----------
+    val_size : float
+        The validation size, sampled from the train partition.
+    test_size : float
+        The test size, the latest transactions.
+    features : list[str]
+        The model features, by default ``FEATURES``.
+    start : float
+        Use the transactions with a timestamp greater than ``start``.
+    end : float
+        Use the transactions with a timestamp lower or equal than ``end``.
+    cache : bool
+        Set to True reads the splits from the memory-mapped cache, see
+        ``get_cached``.
+
     Returns
     --------
     data : pandas.DataFrame
@@ -144,27 +291,38 @@ def get(val_size=.1, test_size=0.3):
         val     14043         39      14004
         test    85443        141      85302
     """
+    if cache:
+        return get_cached(
+            val_size=val_size,
+            test_size=test_size,
+            features=features,
+            start=start,
+            end=end)
 
-    data = cc_transaction_features.get()
-    data['is_known_merchant'] = data['is_known_merchant'].astype(float)
-
-    features = [
-        x
-        for x in data.columns
-        if x.startswith('V')
-    ] + [
-        'Amount',
-        'time_prev_transaction',
-        'km_dist_prev_transaction',
-        'merchant_chargeback_woe',
-        'is_known_merchant'
-    ]
+    features = FEATURES if features is None else features
+    columns = features + [
+        c for c in ['index', 'timestamp', 'Class', 'Amount']
+        if c not in features]
 
     # Get the test partition using an out-of-time strategy
-    is_test = (
-        data['timestamp'] > data['timestamp'].quantile(1 - test_size)
-    )
-    train_data, test_data = data[~is_test], data[is_test]
+    test_start = cc_transaction_features.get_timestamp_quantile(
+        1 - test_size,
+        start=start,
+        end=end)
+
+    train_data = cc_transaction_features.get(
+        columns=columns,
+        start=start,
+        end=test_start)
+    test_data = cc_transaction_features.get(
+        columns=columns,
+        start=test_start,
+        end=end)
+
+    # The row numbers of the processed dataset, unique across the splits
+    train_data, test_data = (
+        data.set_index('index').rename_axis(None)
+        for data in [train_data, test_data])
 
     # Remove outliers from the negative class
     # Negative class is aboundant so we can afford removing the outliners
@@ -189,3 +347,191 @@ def get(val_size=.1, test_size=0.3):
         X_train, X_test, X_val,
         y_train, y_test, y_val,
         w_train, w_test, w_val)
+
+
+def get_source_fingerprint():
+    """Get the fingerprint of the processed dataset files.
+
+    Returns
+    -------
+    fingerprint : str
+        The hash of the path, size and modification time of the files.
+    """
+    files = [
+        (os.path.relpath(path, config.PRJ_DIR), stat.st_size, stat.st_mtime_ns)
+        for path, stat in (
+            (path, os.stat(path))
+            for path in cc_transaction_features.get_paths())
+    ]
+
+    return hashlib.sha256(json.dumps(files).encode()).hexdigest()
+
+
+def get_cache_path(val_size=.1, test_size=0.3, features=None, start=None,
+                   end=None):
+    """Get the cache folder of the ``get`` arguments.
+
+    Returns
+    -------
+    path : str
+        The cache folder path.
+    """
+    key = json.dumps({
+        'version': CACHE_VERSION,
+        'val_size': val_size,
+        'test_size': test_size,
+        'features': FEATURES if features is None else features,
+        'start': start,
+        'end': end
+    }, sort_keys=True)
+
+    return os.path.join(
+        CACHE_DIR,
+        hashlib.sha256(key.encode()).hexdigest()[:16])
+
+
+def save_cache(path, splits, fingerprint):
+    """Save the splits of ``get`` as ``.npy`` files.
+
+    The files are written to a temporary folder renamed at the end, so
+    readers never see a partial cache.
+
+    Parameters
+    ----------
+    path : str
+        The cache folder path.
+    splits : tuple
+        The output of ``get``.
+    fingerprint : str
+        The output of ``get_source_fingerprint``.
+    """
+    X, y, w = splits[:3], splits[3:6], splits[6:]
+
+    tmp_path = f'{path}.tmp-{uuid.uuid4().hex}'
+    os.makedirs(tmp_path)
+
+    for name, X_split, y_split, w_split in zip(SPLITS, X, y, w):
+        for prefix, values in [
+                ('X', X_split.to_numpy(dtype=float)),
+                ('y', y_split.to_numpy()),
+                ('w', w_split.to_numpy(dtype=float)),
+                ('index', X_split.index.to_numpy())]:
+            np.save(
+                os.path.join(tmp_path, f'{prefix}_{name}.npy'),
+                np.ascontiguousarray(values))
+
+    with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+        json.dump({
+            'fingerprint': fingerprint,
+            'features': X[0].columns.tolist(),
+            'y_name': y[0].name,
+            'w_name': w[0].name
+        }, f)
+
+    # Replace a stale cache, a concurrent writer may have won the race
+    shutil.rmtree(path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+def load_cache(path, fingerprint):
+    """Load the splits of ``get`` memory-mapping the ``.npy`` files.
+
+    Parameters
+    ----------
+    path : str
+        The cache folder path.
+    fingerprint : str
+        The output of ``get_source_fingerprint``.
+
+    Returns
+    -------
+    splits : tuple
+        The splits as ``get``, backed by read-only memory maps. None if
+        there is no cache or it is stale.
+    """
+    try:
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+
+    if manifest['fingerprint'] != fingerprint:
+        return None
+
+    def load(prefix, name):
+        return np.load(
+            os.path.join(path, f'{prefix}_{name}.npy'),
+            mmap_mode='r')
+
+    X, y, w = [], [], []
+    for name in SPLITS:
+        index = pd.Index(load('index', name))
+
+        X.append(pd.DataFrame(
+            load('X', name),
+            index=index,
+            columns=manifest['features'],
+            copy=False))
+        y.append(pd.Series(
+            load('y', name),
+            index=index,
+            name=manifest['y_name'],
+            copy=False))
+        w.append(pd.Series(
+            load('w', name),
+            index=index,
+            name=manifest['w_name'],
+            copy=False))
+
+    return tuple(X + y + w)
+
+
+def get_cached(val_size=.1, test_size=0.3, features=None, start=None,
+               end=None):
+    """Get the dataset from the memory-mapped cache.
+
+    The splits of ``get`` are materialized once per arguments as ``.npy``
+    files and rebuilt when the processed dataset files change. Every
+    process reading the cache shares the same read-only pages. The
+    feature matrices are float64.
+
+    Parameters
+    ----------
+    val_size : float
+        The validation size, sampled from the train partition.
+    test_size : float
+        The test size, the latest transactions.
+    features : list[str]
+        The model features, by default ``FEATURES``.
+    start : float
+        Use the transactions with a timestamp greater than ``start``.
+    end : float
+        Use the transactions with a timestamp lower or equal than ``end``.
+
+    Returns
+    --------
+    splits : tuple
+        The same splits as ``get``.
+    """
+    kwargs = dict(
+        val_size=val_size,
+        test_size=test_size,
+        features=features,
+        start=start,
+        end=end)
+
+    path = get_cache_path(**kwargs)
+    fingerprint = get_source_fingerprint()
+
+    splits = load_cache(path, fingerprint)
+    if splits is None:
+        splits = get(**kwargs)
+        save_cache(path, splits, fingerprint)
+
+        # Serve the memory maps, unless a concurrent writer replaced them
+        splits = load_cache(path, fingerprint) or splits
+
+    return splits
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Vectorized distances between geolocations.
+
+All the functions take arrays of latitudes and longitudes in degrees and
+return the distances in kilometers, one per pair of points.
+
+Two methods are available:
+
+- ``haversine``: great-circle distance on a sphere of radius
+  ``EARTH_RADIUS_KM``. It is the fastest one, but it ignores the earth
+  flattening, the relative error against the ellipsoidal distance is up
+  to 0.6%.
+- ``geodesic``: Vincenty's inverse solution on the WGS-84 ellipsoid,
+  iterated over whole arrays. It agrees with ``geopy.distance.geodesic``
+  (Karney's algorithm) to less than 1 millimeter. Nearly antipodal
+  points, for which Vincenty's iteration does not converge, fall back to
+  the haversine distance.
+"""
+import numpy as np
+
+# Mean earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+# WGS-84 ellipsoid
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B_KM = (1 - WGS84_F) * WGS84_A_KM
+
+METHODS = ['geodesic', 'haversine']
+
+
+def _as_arrays(*values):
+    return np.broadcast_arrays(*[
+        np.asarray(v, dtype=float)
+        for v in values
+    ])
+
+
+def _vincenty_terms(lam, sinU1, cosU1, sinU2, cosU2):
+    sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+    sin_sigma = np.sqrt(
+        (cosU2 * sin_lam) ** 2 + (
+            cosU1 * sinU2 - sinU1 * cosU2 * cos_lam
+        ) ** 2)
+    cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+    sigma = np.arctan2(sin_sigma, cos_sigma)
+
+    # Coincident points
+    sin_alpha = np.where(
+        sin_sigma == 0, 0, cosU1 * cosU2 * sin_lam / sin_sigma)
+    cos2_alpha = 1 - sin_alpha ** 2
+
+    # Equatorial lines
+    cos_2sigma_m = np.where(
+        cos2_alpha == 0,
+        0,
+        cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+
+    return (
+        sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, cos_2sigma_m)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Compute the great-circle distance between geolocations.
+
+    Parameters
+    ----------
+    lat1, lon1 : numpy.ndarray
+        The latitudes and longitudes of the first locations.
+    lat2, lon2 : numpy.ndarray
+        The latitudes and longitudes of the second locations.
+
+    Returns
+    --------
+    distance : numpy.ndarray
+        The distances in kilometers.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import geo_distance
+
+        geo_distance.haversine(37.7749, -122.4194, 34.0522, -118.2437)
+        Out[1]: array(559.12134935)
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, _as_arrays(
+        lat1, lon1, lat2, lon2))
+
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+    ) + (
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def geodesic(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """Compute the distance on the WGS-84 ellipsoid between geolocations.
+
+    Parameters
+    ----------
+    lat1, lon1 : numpy.ndarray
+        The latitudes and longitudes of the first locations.
+    lat2, lon2 : numpy.ndarray
+        The latitudes and longitudes of the second locations.
+    max_iter : int
+        Max. number of Vincenty iterations.
+    tol : float
+        Convergence tolerance of the longitude on the auxiliary sphere.
+
+    Returns
+    --------
+    distance : numpy.ndarray
+        The distances in kilometers.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import geo_distance
+
+        geo_distance.geodesic(37.7749, -122.4194, 34.0522, -118.2437)
+        Out[1]: array(559.0423365)
+    """
+    lat1, lon1, lat2, lon2 = _as_arrays(lat1, lon1, lat2, lon2)
+    shape = lat1.shape
+    lat1, lon1, lat2, lon2 = [
+        x.ravel() for x in (lat1, lon1, lat2, lon2)]
+
+    f = WGS84_F
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    # Iterate only the pairs that have not converged yet
+    lam = L.copy()
+    converged = np.isnan(L) | np.isnan(U1) | np.isnan(U2)
+    active = np.flatnonzero(~converged)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for _ in range(max_iter):
+            if active.size == 0:
+                break
+
+            sin_sigma, cos_sigma, sigma, sin_alpha, cos2_alpha, \
+                cos_2sigma_m = _vincenty_terms(
+                    lam[active],
+                    sinU1[active], cosU1[active],
+                    sinU2[active], cosU2[active])
+
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_next = L[active] + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (
+                    cos_2sigma_m + C * cos_sigma * (
+                        -1 + 2 * cos_2sigma_m ** 2)))
+
+            is_done = np.abs(lam_next - lam[active]) < tol
+            lam[active] = lam_next
+            active = active[~is_done]
+
+        sin_sigma, cos_sigma, sigma, _, cos2_alpha, \
+            cos_2sigma_m = _vincenty_terms(lam, sinU1, cosU1, sinU2, cosU2)
+
+    u2 = cos2_alpha * (WGS84_A_KM ** 2 - WGS84_B_KM ** 2) / WGS84_B_KM ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta_sigma = B * sin_sigma * (
+        cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2) - (
+                B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (
+                    -3 + 4 * cos_2sigma_m ** 2))))
+
+    distance = WGS84_B_KM * A * (sigma - delta_sigma)
+
+    # Nearly antipodal points
+    if active.size > 0:
+        distance[active] = haversine(
+            lat1[active], lon1[active], lat2[active], lon2[active])
+
+    return distance.reshape(shape)
+
+
+def distance(lat1, lon1, lat2, lon2, method='geodesic'):
+    """Compute the distance between geolocations.
+
+    Parameters
+    ----------
+    lat1, lon1 : numpy.ndarray
+        The latitudes and longitudes of the first locations.
+    lat2, lon2 : numpy.ndarray
+        The latitudes and longitudes of the second locations.
+    method : str
+        Either 'geodesic' or 'haversine'.
+
+    Returns
+    --------
+    distance : numpy.ndarray
+        The distances in kilometers.
+    """
+    if method == 'geodesic':
+        return geodesic(lat1, lon1, lat2, lon2)
+    elif method == 'haversine':
+        return haversine(lat1, lon1, lat2, lon2)
+
+    raise ValueError(f'method must be one of {METHODS}, got {method}')
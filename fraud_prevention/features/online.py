@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import bisect
+import threading
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from fraud_prevention.features import geo_distance
+from fraud_prevention.features import velocity
+from fraud_prevention.features import cc_transaction_features
+
+
+class VelocityWindow:
+    """The running velocity aggregates of a credit card over a window.
+
+    The transactions enter the window in timestamp order and expire from
+    its start, the counts, amount sum and merchant counts are updated as
+    they enter and expire, and the max amount is the head of a monotonic
+    deque, so each transaction costs amortized constant time.
+
+    Parameters
+    ----------
+    size : float
+        The window size.
+    """
+    __slots__ = [
+        'size', 'entries', 'amount_sum', 'merchant_counts', 'amount_max',
+        'nb_expired']
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = deque()
+        self.amount_sum = 0.
+        self.merchant_counts = {}
+        self.amount_max = deque()
+        self.nb_expired = 0
+
+    def append(self, timestamp, amount, merchant):
+        """Add a transaction, later than the ones of the window."""
+        self.entries.append((timestamp, amount, merchant))
+        self.amount_sum += amount
+        self.merchant_counts[merchant] = \
+            self.merchant_counts.get(merchant, 0) + 1
+
+        # The (position, amount) of the decreasing suffix maxima
+        while self.amount_max and self.amount_max[-1][1] <= amount:
+            self.amount_max.pop()
+        self.amount_max.append((
+            self.nb_expired + len(self.entries) - 1,
+            amount))
+
+    def expire(self, start):
+        """Remove the transactions before the window start."""
+        while self.entries and self.entries[0][0] < start:
+            _, amount, merchant = self.entries.popleft()
+            self.amount_sum -= amount
+            self.merchant_counts[merchant] -= 1
+            if self.merchant_counts[merchant] == 0:
+                del self.merchant_counts[merchant]
+
+            if self.amount_max[0][0] == self.nb_expired:
+                self.amount_max.popleft()
+            self.nb_expired += 1
+
+        # No rounding drift is carried over once the window is empty
+        if not self.entries:
+            self.amount_sum = 0.
+
+    def get_features(self):
+        """Get the velocity features of the window."""
+        return {
+            f'nb_transactions_{self.size:g}min': len(self.entries),
+            f'amount_sum_{self.size:g}min': self.amount_sum,
+            f'amount_max_{self.size:g}min': (
+                self.amount_max[0][1] if self.amount_max else np.nan),
+            f'nb_merchants_{self.size:g}min': len(self.merchant_counts)
+        }
+
+
+class CardState:
+    """The state of a credit card needed by its next transaction features.
+
+    Parameters
+    ----------
+    timestamp : float
+        The timestamp of the last transaction.
+    latitude : float
+        The latitude of the last transaction.
+    longitude : float
+        The longitude of the last transaction.
+    merchants : dict
+        The last timestamp of each merchant of the previous transactions.
+    windows : list[float]
+        The velocity window sizes.
+    """
+    __slots__ = [
+        'timestamp', 'latitude', 'longitude', 'merchants', 'windows',
+        'pending']
+
+    def __init__(self, timestamp, latitude, longitude, merchants=None,
+                 windows=velocity.WINDOWS_MIN):
+        self.timestamp = timestamp
+        self.latitude = latitude
+        self.longitude = longitude
+        self.merchants = {} if merchants is None else merchants
+        self.windows = [VelocityWindow(w) for w in windows]
+
+        # The transactions not yet strictly before a featurized one
+        self.pending = deque()
+
+    def add_transaction(self, timestamp, amount, merchant):
+        """Add a transaction to the velocity windows.
+
+        The transactions of a card are added in timestamp order.
+        """
+        self.pending.append((timestamp, amount, merchant))
+
+    def get_velocity_features(self, timestamp):
+        """Get the velocity features of a transaction of the card.
+
+        The windows are moved to the timestamp, the transactions of the
+        card must be featurized in timestamp order.
+
+        Parameters
+        ----------
+        timestamp : float
+            The transaction timestamp.
+
+        Returns
+        -------
+        velocity_features : dict
+            The velocity features.
+        """
+        # The transactions with the same timestamp stay out of the windows
+        while self.pending and self.pending[0][0] < timestamp:
+            transaction = self.pending.popleft()
+            for window in self.windows:
+                window.append(*transaction)
+
+        velocity_features = {}
+        for window in self.windows:
+            window.expire(timestamp - window.size)
+            velocity_features.update(window.get_features())
+
+        return velocity_features
+
+
+class OnlineFeatureStore:
+    """Compute the transaction features of single incoming transactions.
+
+    Keeps, per credit card, the last timestamp and geolocation, the last
+    timestamp of each known merchant and the running aggregates of the
+    velocity windows, and the latest merchant chargeback WOE table. Each
+    transaction is featurized in amortized constant time, with the same
+    definitions as ``cc_transaction_features.process``. The transactions
+    of a card are expected in timestamp order.
+
+    Parameters
+    ----------
+    merchant_chargeback_woe : pandas.DataFrame
+        The output of ``cc_transaction_features.get_merchant_charback_woe``.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+    windows : list[float]
+        The velocity window sizes.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import online
+        from fraud_prevention.features import cc_transaction_features
+
+        data = cc_transaction_features.get()
+
+        store = online.OnlineFeatureStore.from_data(
+            data,
+            merchant_chargeback_woe=(
+                cc_transaction_features.get_merchant_charback_woe(data)))
+
+        store.transform({
+            'credit_card_number': 346024495269014,
+            'timestamp': 172800.0,
+            'latitude': 41.72059,
+            'longitude': -87.70172,
+            'merchant': 'restaurant_1',
+            'Amount': 149.62})
+        Out[1]:
+        {'time_prev_transaction': 92.0,
+         'km_dist_prev_transaction': 1383.436123,
+         'merchant_chargeback_woe': -1.315307,
+         'is_known_merchant': 1.0,
+         'nb_known_merchants': 4,
+         'time_prev_merchant_transaction': 1320.0,
+         'nb_transactions_1min': 0,
+         ...
+         'nb_merchants_60min': 0}
+    """
+
+    def __init__(self, merchant_chargeback_woe=None,
+                 distance_method='geodesic', windows=velocity.WINDOWS_MIN):
+        self.distance_method = distance_method
+        self.windows = windows
+        self.cards = {}
+
+        self._woe_timestamps = []
+        self._woe_values = {}
+
+        # Guards the card states, one transaction at a time
+        self._lock = threading.Lock()
+
+        if merchant_chargeback_woe is not None:
+            self.set_merchant_woe(merchant_chargeback_woe)
+
+    @property
+    def feature_names(self):
+        """The names of the features computed by ``transform``."""
+        return [
+            'time_prev_transaction',
+            'km_dist_prev_transaction',
+            'merchant_chargeback_woe',
+            'is_known_merchant',
+            'nb_known_merchants',
+            'time_prev_merchant_transaction'
+        ] + velocity.get_feature_names(self.windows)
+
+    @classmethod
+    def from_data(cls, data, merchant_chargeback_woe=None, **kwargs):
+        """Build the store from the transaction history.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            The transaction history, with at least the columns
+            ``credit_card_number``, ``timestamp``, ``latitude``,
+            ``longitude``, ``merchant`` and ``Amount``.
+        merchant_chargeback_woe : pandas.DataFrame
+            The output of
+            ``cc_transaction_features.get_merchant_charback_woe``.
+
+        Returns
+        -------
+        store : OnlineFeatureStore
+            The feature store.
+        """
+        store = cls(merchant_chargeback_woe=merchant_chargeback_woe, **kwargs)
+
+        data = data.sort_values('timestamp', kind='mergesort')
+        data_grp = data.groupby('credit_card_number', sort=False)
+
+        last = data_grp[['timestamp', 'latitude', 'longitude']].last()
+        merchants = data.groupby(
+            ['credit_card_number', 'merchant'],
+            sort=False,
+            observed=True
+        )['timestamp'].last().astype(float)
+        merchants = {
+            cc_number: cc_merchants.droplevel(0).to_dict()
+            for cc_number, cc_merchants in merchants.groupby(
+                level=0, sort=False)
+        }
+
+        for cc_number, timestamp, latitude, longitude, cc_merchants in zip(
+                last.index,
+                last['timestamp'].astype(float),
+                last['latitude'].astype(float),
+                last['longitude'].astype(float),
+                [merchants[cc_number] for cc_number in last.index]):
+            store.cards[cc_number] = CardState(
+                timestamp=timestamp,
+                latitude=latitude,
+                longitude=longitude,
+                merchants=cc_merchants,
+                windows=store.windows)
+
+        # Transactions within the largest window of the next transaction
+        recent = data[
+            data['timestamp'] >=
+            data_grp['timestamp'].transform('max') - max(store.windows)]
+        for cc_number, timestamp, amount, merchant in zip(
+                recent['credit_card_number'],
+                recent['timestamp'].astype(float),
+                recent['Amount'].astype(float),
+                recent['merchant']):
+            store.cards[cc_number].add_transaction(timestamp, amount, merchant)
+
+        return store
+
+    def set_merchant_woe(self, merchant_chargeback_woe):
+        """Set the merchant chargeback WOE table.
+
+        Parameters
+        ----------
+        merchant_chargeback_woe : pandas.DataFrame
+            The output of
+            ``cc_transaction_features.get_merchant_charback_woe``.
+        """
+        woe = merchant_chargeback_woe[
+            merchant_chargeback_woe.index.notna()
+        ].sort_index()
+
+        # Replace the table at once, readers never see a partial update.
+        # The NaN column of the unknown merchants is left out.
+        self._woe_timestamps, self._woe_values = (
+            woe.index.astype(float).tolist(),
+            {
+                merchant: woe[merchant].to_numpy(dtype=float)
+                for merchant in woe.columns
+                if not pd.isna(merchant)
+            })
+
+    def get_merchant_woe(self, merchant, timestamp):
+        """Get the latest merchant chargeback WOE before a timestamp.
+
+        Parameters
+        ----------
+        merchant : str
+            The merchant.
+        timestamp : float
+            The transaction timestamp.
+
+        Returns
+        -------
+        merchant_chargeback_woe : float
+            The WOE, NaN when there is no valid one.
+        """
+        woe_timestamps, woe_values = self._woe_timestamps, self._woe_values
+
+        woe_idx = bisect.bisect_left(woe_timestamps, timestamp) - 1
+        if (woe_idx < 0) or (merchant not in woe_values):
+            return np.nan
+
+        return woe_values[merchant][woe_idx]
+
+    def transform(self, transaction, update=True):
+        """Compute the features of a transaction.
+
+        Parameters
+        ----------
+        transaction : dict
+            The transaction, with the keys ``credit_card_number``,
+            ``timestamp``, ``latitude``, ``longitude``, ``merchant`` and
+            ``Amount``.
+        update : bool
+            Set to False prevents adding the transaction to the card state,
+            its velocity windows still move to the timestamp.
+
+        Returns
+        -------
+        features : dict
+            The transaction features.
+        """
+        cc_number = transaction['credit_card_number']
+        timestamp = float(transaction['timestamp'])
+        latitude = float(transaction['latitude'])
+        longitude = float(transaction['longitude'])
+        merchant = transaction['merchant']
+        amount = float(transaction['Amount'])
+
+        with self._lock:
+            state = self.cards.get(cc_number)
+
+            if state is None:
+                time_prev_transaction = np.nan
+                prev_geo = None
+                is_known_merchant = 0.
+                nb_known_merchants = 0
+                time_prev_merchant_transaction = np.nan
+                velocity_features = CardState(
+                    timestamp, latitude, longitude,
+                    windows=self.windows).get_velocity_features(timestamp)
+            else:
+                time_prev_transaction = timestamp - state.timestamp
+                prev_geo = (state.latitude, state.longitude)
+                is_known_merchant = float(merchant in state.merchants)
+                nb_known_merchants = len(state.merchants)
+                time_prev_merchant_transaction = (
+                    timestamp - state.merchants[merchant]
+                    if merchant in state.merchants else np.nan)
+                velocity_features = state.get_velocity_features(timestamp)
+
+            if update:
+                if state is None:
+                    state = self.cards[cc_number] = CardState(
+                        timestamp, latitude, longitude, windows=self.windows)
+                else:
+                    state.timestamp = timestamp
+                    state.latitude = latitude
+                    state.longitude = longitude
+                state.merchants[merchant] = timestamp
+
+                state.add_transaction(timestamp, amount, merchant)
+
+        if prev_geo is None:
+            km_dist_prev_transaction = np.nan
+        else:
+            km_dist_prev_transaction = float(geo_distance.distance(
+                *prev_geo,
+                latitude,
+                longitude,
+                method=self.distance_method))
+
+        return {
+            'time_prev_transaction': time_prev_transaction,
+            'km_dist_prev_transaction': km_dist_prev_transaction,
+            'merchant_chargeback_woe': self.get_merchant_woe(
+                merchant, timestamp),
+            'is_known_merchant': is_known_merchant,
+            'nb_known_merchants': nb_known_merchants,
+            'time_prev_merchant_transaction': time_prev_merchant_transaction,
+            **velocity_features
+        }
+
+
+def check_parity(history, data, merchant_chargeback_woe=None,
+                 distance_method='geodesic', atol=1e-6):
+    """Check the online features against the batch features.
+
+    The store is built from the history and transforms the transactions
+    of the data one at a time, the batch features are computed on the
+    history and the data at once.
+
+    Parameters
+    ----------
+    history : pandas.DataFrame
+        The transaction history, see ``OnlineFeatureStore.from_data``.
+    data : pandas.DataFrame
+        The transactions, newer than the history.
+    merchant_chargeback_woe : pandas.DataFrame
+        The output of ``cc_transaction_features.get_merchant_charback_woe``,
+        None to skip the ``merchant_chargeback_woe`` feature.
+    distance_method : str
+        The ``geo_distance`` method, either 'geodesic' or 'haversine'.
+    atol : float
+        The maximum absolute difference of the features.
+
+    Returns
+    -------
+    max_diff : pandas.Series
+        The maximum absolute difference of each feature.
+    """
+    store = OnlineFeatureStore.from_data(
+        history,
+        merchant_chargeback_woe=merchant_chargeback_woe,
+        distance_method=distance_method)
+
+    data = data.sort_values('timestamp', kind='mergesort')
+    online_features = pd.DataFrame(
+        [store.transform(transaction)
+         for transaction in data.to_dict('records')],
+        index=data.index)
+
+    full = pd.concat([history, data], ignore_index=True)
+    batch_features = pd.concat([
+        cc_transaction_features.compute_transaction_features(
+            full,
+            distance_method=distance_method),
+        velocity.compute_velocity_features(full, windows=store.windows)
+    ], axis=1)
+    if merchant_chargeback_woe is not None:
+        batch_features['merchant_chargeback_woe'] = \
+            cc_transaction_features.get_merchant_woe_asof(
+                full,
+                merchant_chargeback_woe)
+    batch_features = batch_features.iloc[len(history):].set_axis(
+        data.index)
+
+    max_diff = {}
+    for feature in store.feature_names:
+        if feature not in batch_features:
+            continue
+
+        expected = batch_features[feature].to_numpy(dtype=float)
+        actual = online_features[feature].to_numpy(dtype=float)
+
+        # The single transaction cards have no batch is_known_merchant
+        is_compared = ~np.isnan(expected) | (
+            feature != 'is_known_merchant')
+        expected, actual = expected[is_compared], actual[is_compared]
+
+        is_nan = np.isnan(expected)
+        if (is_nan != np.isnan(actual)).any():
+            max_diff[feature] = np.inf
+        else:
+            max_diff[feature] = float(np.max(
+                np.abs(expected[~is_nan] - actual[~is_nan]), initial=0.))
+
+    max_diff = pd.Series(max_diff)
+    if (max_diff > atol).any():
+        raise ValueError(
+            'The online features differ from the batch features: '
+            f'{max_diff[max_diff > atol].to_dict()}')
+
+    return max_diff
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Column dtypes of the processed datasets.
+
+The processed parquet files are written with these dtypes. Parquet stores
+them along with the data, so the loaders do not need any recasting.
+"""
+import pandas as pd
+
+# Principal components, float32 keeps their ~7 significant digits
+PCA_FEATURES = [f'V{i}' for i in range(1, 29)]
+
+CREDIT_CARD_DTYPES = {
+    'credit_card_number': 'int64',
+    'latitude': 'float64',
+    'longitude': 'float64',
+    'timestamp': 'float64',
+    'merchant': 'category',
+    **{feature: 'float32' for feature in PCA_FEATURES},
+    'Amount': 'float64',
+    'Class': 'int8'
+}
+
+CC_TRANSACTION_FEATURES_DTYPES = {
+    'index': 'int64',
+    **CREDIT_CARD_DTYPES,
+    # 1 for known, 0 for new and NaN for the single transaction cards
+    'is_known_merchant': 'float32',
+    'nb_known_merchants': 'int32'
+}
+
+
+def apply(data, dtypes):
+    """Cast the data columns to the schema dtypes.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data.
+    dtypes : dict
+        The dtype of each column, columns not in ``data`` are ignored.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The data with the schema dtypes.
+    """
+    dtypes = {
+        column: dtype
+        for column, dtype in dtypes.items()
+        if column in data.columns and not (
+            # Keep the categories of already categorical columns
+            dtype == 'category' and
+            isinstance(data[column].dtype, pd.CategoricalDtype))
+    }
+
+    return data.astype(dtypes)
+
+
+def concat(frames):
+    """Concatenate data with the same schema.
+
+    The categorical columns are kept categorical, with the union of the
+    categories of every frame.
+
+    Parameters
+    ----------
+    frames : list[pandas.DataFrame]
+        The data.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The concatenated data, with a new range index.
+    """
+    frames = list(frames)
+
+    for column in frames[0].columns:
+        if not all(
+                isinstance(frame[column].dtype, pd.CategoricalDtype)
+                for frame in frames):
+            continue
+
+        categories = frames[0][column].cat.categories
+        for frame in frames[1:]:
+            categories = categories.union(
+                frame[column].cat.categories,
+                sort=False)
+
+        frames = [
+            frame.assign(**{
+                column: frame[column].cat.set_categories(categories)})
+            for frame in frames
+        ]
+
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Timestamp partitioned parquet layout of the processed datasets.
+
+The data is written hive-style, one folder per time bucket::
+
+    credit_card.parquet/
+        time_bucket=000000000000/part-000000000000.parquet
+        time_bucket=000000086400/part-000000000000.parquet
+
+with the rows sorted by timestamp inside each file and row groups of
+``ROW_GROUP_SIZE`` rows, so time ranges are read by partition and row
+group pruning. Files of a partition sort by name in time order.
+"""
+import os
+import glob
+import shutil
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITION_COLUMN = 'time_bucket'
+
+# Timestamp units per partition
+PARTITION_SIZE = 86_400
+
+ROW_GROUP_SIZE = 65_536
+
+PARTITIONING = ds.partitioning(
+    pa.schema([(PARTITION_COLUMN, pa.int64())]),
+    flavor='hive')
+
+
+def get_time_bucket(timestamp, partition_size=PARTITION_SIZE):
+    """Get the time bucket of the timestamps.
+
+    Parameters
+    ----------
+    timestamp : numpy.ndarray
+        The timestamps.
+    partition_size : int
+        The timestamp units per partition.
+
+    Returns
+    -------
+    time_bucket : numpy.ndarray
+        The start timestamp of the bucket of each timestamp.
+    """
+    timestamp = np.asarray(timestamp, dtype=float)
+
+    return (np.floor(timestamp / partition_size) * partition_size).astype(
+        np.int64)
+
+
+def get_files(path):
+    """Get the parquet files of a dataset.
+
+    Parameters
+    ----------
+    path : str
+        The parquet file or partitioned folder path.
+
+    Returns
+    -------
+    paths : list[str]
+        The parquet files, in time order.
+    """
+    if not os.path.isdir(path):
+        return [path]
+
+    return sorted(glob.glob(os.path.join(
+        path,
+        f'{PARTITION_COLUMN}=*',
+        '*.parquet')))
+
+
+def iter_batches(path, columns=None, batch_size=ROW_GROUP_SIZE):
+    """Read a parquet file or partitioned folder in record batches.
+
+    The files are read one after the other, in time order.
+
+    Parameters
+    ----------
+    path : str
+        The parquet file or partitioned folder path.
+    columns : list[str]
+        The columns to read, by default all of them.
+    batch_size : int
+        The maximum number of rows per batch.
+
+    Yields
+    ------
+    batch : pyarrow.RecordBatch
+        The record batches.
+    """
+    for f in get_files(path):
+        yield from pq.ParquetFile(f).iter_batches(
+            batch_size=batch_size,
+            columns=columns)
+
+
+def remove(path):
+    """Remove a parquet file or partitioned folder, if any.
+
+    Parameters
+    ----------
+    path : str
+        The parquet file or partitioned folder path.
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def write_partitioned(data, path, basename='part-000000000000',
+                      partition_size=PARTITION_SIZE,
+                      row_group_size=ROW_GROUP_SIZE):
+    """Write the data to the partitions of its time buckets.
+
+    Existing files of the partitions are kept, new data is added with a
+    new ``basename``.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, with a ``timestamp`` column.
+    path : str
+        The partitioned folder path.
+    basename : str
+        The file name in each partition, later data needs later names.
+    partition_size : int
+        The timestamp units per partition.
+    row_group_size : int
+        The number of rows per row group.
+    """
+    time_bucket = get_time_bucket(data['timestamp'], partition_size)
+
+    order = np.lexsort((data['timestamp'].to_numpy(dtype=float), time_bucket))
+    time_bucket = time_bucket[order]
+    data = data.iloc[order]
+
+    offsets = np.flatnonzero(np.diff(time_bucket)) + 1
+    for start, stop in zip(
+            np.concatenate([[0], offsets]),
+            np.concatenate([offsets, [len(data)]])):
+        partition = os.path.join(
+            path,
+            f'{PARTITION_COLUMN}={time_bucket[start]:012d}')
+        os.makedirs(partition, exist_ok=True)
+
+        pq.write_table(
+            pa.Table.from_pandas(
+                data.iloc[start:stop],
+                preserve_index=False),
+            os.path.join(partition, f'{basename}.parquet'),
+            row_group_size=row_group_size)
+
+
+def compact(path, row_group_size=ROW_GROUP_SIZE):
+    """Merge the files of each partition into a single sorted file.
+
+    Parameters
+    ----------
+    path : str
+        The partitioned folder path.
+    row_group_size : int
+        The number of rows per row group.
+    """
+    for partition in sorted(glob.glob(os.path.join(
+            path, f'{PARTITION_COLUMN}=*'))):
+        files = sorted(glob.glob(os.path.join(partition, '*.parquet')))
+        if len(files) < 2:
+            continue
+
+        table = pa.concat_tables(
+            [pq.read_table(f) for f in files],
+            promote_options='permissive')
+        table = table.take(pc.sort_indices(
+            table,
+            sort_keys=[('timestamp', 'ascending')]))
+
+        # Replace the files once the merged one is complete
+        tmp_path = os.path.join(partition, '.compact.parquet.tmp')
+        pq.write_table(table, tmp_path, row_group_size=row_group_size)
+        for f in files:
+            os.remove(f)
+        os.replace(tmp_path, files[0])
+
+
+def get_time_buckets(path):
+    """Get the time buckets of a partitioned folder.
+
+    Parameters
+    ----------
+    path : str
+        The partitioned folder path.
+
+    Returns
+    -------
+    time_buckets : list[int]
+        The sorted start timestamps of the partitions.
+    """
+    return sorted(
+        int(os.path.basename(partition).split('=')[1])
+        for partition in glob.glob(os.path.join(
+            path, f'{PARTITION_COLUMN}=*')))
+
+
+def get_partition_filters(filters, time_buckets):
+    """Get the partition filters implied by timestamp filters.
+
+    Parameters
+    ----------
+    filters : list[tuple]
+        The row filters.
+    time_buckets : list[int]
+        The sorted start timestamps of the partitions.
+
+    Returns
+    -------
+    filters : list[tuple]
+        The row filters, with the time bucket filters added.
+    """
+    partition_filters = []
+    for column, op, value in filters or []:
+        if column != 'timestamp':
+            continue
+
+        # The lower bound falls in the last bucket starting before it
+        if op in ('>', '>=', '=='):
+            start = [b for b in time_buckets if b <= value]
+            if start:
+                partition_filters.append(
+                    (PARTITION_COLUMN, '>=', start[-1]))
+        if op in ('<', '<=', '=='):
+            partition_filters.append((PARTITION_COLUMN, '<=', value))
+
+    return (list(filters or []) + partition_filters) or None
+
+
+def read(path, columns=None, filters=None):
+    """Read a parquet file or partitioned folder.
+
+    Parameters
+    ----------
+    path : str
+        The parquet file or partitioned folder path.
+    columns : list[str]
+        The columns to read, by default all of them.
+    filters : list[tuple]
+        The ``pandas.read_parquet`` row filters, e.g.
+        ``[('timestamp', '>', 1000.)]``.
+
+    Returns
+    -------
+    data : pandas.DataFrame
+        The data, without the partition column.
+    """
+    if not os.path.isdir(path):
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+    data = pd.read_parquet(
+        path,
+        columns=columns,
+        filters=get_partition_filters(filters, get_time_buckets(path)),
+        partitioning=PARTITIONING)
+
+    return data.drop(columns=[PARTITION_COLUMN], errors='ignore')
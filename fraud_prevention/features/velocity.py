@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Per credit card transaction velocity features over rolling time windows.
+
+For each transaction and window size ``w`` the features aggregate the
+transactions of the same credit card with a timestamp in
+``[timestamp - w, timestamp)``, i.e. strictly before the transaction, the
+same leak prevention rule of the merchant chargeback WOE.
+
+The window sizes are in the timestamp units, the ones of the time deltas
+in ``features.creditcard.FRAUDSTERS_TIME_DISTANCE_MIN``.
+"""
+import numpy as np
+import pandas as pd
+
+WINDOWS_MIN = [1, 10, 60]
+
+
+def get_feature_names(windows=WINDOWS_MIN):
+    """Get the velocity feature names.
+
+    Parameters
+    ----------
+    windows : list[float]
+        The window sizes.
+
+    Returns
+    -------
+    features : list[str]
+        The feature names.
+    """
+    return [
+        f'{feature}_{w:g}min'
+        for w in windows
+        for feature in [
+            'nb_transactions', 'amount_sum', 'amount_max', 'nb_merchants']
+    ]
+
+
+def get_card_bounds(cc_codes, timestamp, values):
+    """Get the first transaction of each card at or after a timestamp.
+
+    The bounds are found within each credit card, the transactions are
+    merged with the searched values in one (credit card, timestamp) sort,
+    so the card codes and timestamps are never packed in a single key.
+
+    Parameters
+    ----------
+    cc_codes : numpy.ndarray
+        The credit card code of each transaction, sorted.
+    timestamp : numpy.ndarray
+        The timestamp of each transaction, sorted within each card.
+    values : numpy.ndarray
+        The searched timestamp of each transaction.
+
+    Returns
+    -------
+    bounds : numpy.ndarray
+        The position of the first transaction of the same credit card with
+        a timestamp greater or equal than the searched value.
+    """
+    n_rows = len(cc_codes)
+
+    # The searched values sort before the transactions with equal keys
+    is_row = np.repeat([False, True], n_rows)
+    merged = np.lexsort((
+        is_row,
+        np.concatenate([values, timestamp]),
+        np.concatenate([cc_codes, cc_codes])))
+
+    is_row = is_row[merged]
+    nb_rows_before = np.cumsum(is_row) - is_row
+
+    bounds = np.empty(n_rows, dtype=int)
+    bounds[merged[~is_row]] = nb_rows_before[~is_row]
+
+    return bounds
+
+
+def get_window_max(values, left, right):
+    """Get the max of the values of each window.
+
+    The max of ``values[left:right]`` is the max of its two overlapping
+    power of two blocks, computed by doubling the block size, so the
+    cost is O(n log n) whatever the window sizes.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values.
+    left : numpy.ndarray
+        The window starts.
+    right : numpy.ndarray
+        The window ends, excluded.
+
+    Returns
+    -------
+    window_max : numpy.ndarray
+        The max of each window, NaN for the empty ones.
+    """
+    length = right - left
+    window_max = np.full(len(values), np.nan)
+
+    is_window = length > 0
+    if not is_window.any():
+        return window_max
+
+    # floor(log2(length)), exact for integers
+    level = np.full(len(values), -1)
+    level[is_window] = np.frexp(length[is_window])[1] - 1
+
+    # The max of values[j:j + size], for the blocks within the values
+    block_max, size = values, 1
+    for k in range(level.max() + 1):
+        idx = np.flatnonzero(level == k)
+        window_max[idx] = np.fmax(
+            block_max[left[idx]],
+            block_max[right[idx] - size])
+
+        block_max = np.fmax(block_max[:-size], block_max[size:])
+        size *= 2
+
+    return window_max
+
+
+def compute_velocity_features(data, windows=WINDOWS_MIN):
+    """Compute the velocity features of all the credit cards at once.
+
+    The data is sorted once by credit card and timestamp. The window
+    bounds of every transaction are found within its credit card, counts
+    and amount sums come from cumulative sums, the max amount from
+    power of two blocks and the distinct merchants from the rows
+    entering and leaving the windows, so the cost is O(n log n) even
+    for the credit cards with many transactions per window.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, with at least the columns ``credit_card_number``,
+        ``timestamp``, ``Amount`` and ``merchant``.
+    windows : list[float]
+        The window sizes.
+
+    Returns
+    -------
+    velocity_features : pandas.DataFrame
+        The velocity features, indexed as ``data``.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import creditcard
+        from fraud_prevention.features import velocity
+
+        data = creditcard.get()
+
+        velocity.compute_velocity_features(data, windows=[10]).head()
+        Out[1]:
+           nb_transactions_10min  amount_sum_10min  amount_max_10min  \
+        0                      0              0.00               NaN
+        1                      0              0.00               NaN
+        2                      1            378.66            378.66
+        3                      0              0.00               NaN
+        4                      0              0.00               NaN
+
+           nb_merchants_10min
+        0                   0
+        1                   0
+        2                   1
+        3                   0
+        4                   0
+    """
+    n_rows = len(data)
+
+    cc_codes = pd.factorize(data['credit_card_number'])[0]
+    merchant_codes = pd.factorize(data['merchant'])[0]
+    timestamp = data['timestamp'].to_numpy(dtype=float)
+
+    order = np.lexsort((timestamp, cc_codes))
+    cc_codes = cc_codes[order]
+    merchant_codes = merchant_codes[order]
+    timestamp = timestamp[order]
+    amount = data['Amount'].to_numpy(dtype=float)[order]
+
+    # Previous transaction of the card at the same merchant
+    merchant_order = np.lexsort((merchant_codes, cc_codes))
+    is_prev_same_merchant = np.zeros(n_rows, dtype=bool)
+    is_prev_same_merchant[1:] = (
+        cc_codes[merchant_order][1:] == cc_codes[merchant_order][:-1]
+    ) & (
+        merchant_codes[merchant_order][1:] ==
+        merchant_codes[merchant_order][:-1]
+    )
+    prev_same_merchant = np.full(n_rows, -1)
+    prev_same_merchant[
+        merchant_order[1:][is_prev_same_merchant[1:]]
+    ] = merchant_order[:-1][is_prev_same_merchant[1:]]
+
+    has_prev = np.flatnonzero(prev_same_merchant >= 0)
+
+    cum_amount = np.concatenate([[0], np.cumsum(amount)])
+
+    # Window ends, strictly before the transaction
+    right = get_card_bounds(cc_codes, timestamp, timestamp)
+
+    velocity_features = {}
+    for w in windows:
+        left = get_card_bounds(cc_codes, timestamp, timestamp - w)
+        nb_transactions = right - left
+
+        # A transaction repeats a merchant of the windows holding its
+        # previous transaction at the same merchant, the windows move
+        # forward so these are the rows between two bounds
+        start = np.searchsorted(right, has_prev, side='right')
+        stop = np.searchsorted(
+            left,
+            prev_same_merchant[has_prev],
+            side='right')
+        is_repeat = start < stop
+        nb_repeats = np.cumsum(
+            np.bincount(start[is_repeat], minlength=n_rows + 1) -
+            np.bincount(stop[is_repeat], minlength=n_rows + 1))[:n_rows]
+
+        velocity_features.update({
+            f'nb_transactions_{w:g}min': nb_transactions,
+            f'amount_sum_{w:g}min': cum_amount[right] - cum_amount[left],
+            f'amount_max_{w:g}min': get_window_max(amount, left, right),
+            f'nb_merchants_{w:g}min': nb_transactions - nb_repeats
+        })
+
+    # Back to the original row order
+    position = np.empty_like(order)
+    position[order] = np.arange(n_rows)
+
+    velocity_features = pd.DataFrame({
+        name: values[position]
+        for name, values in velocity_features.items()
+    }, index=data.index)
+
+    return velocity_features
+
+
+def compute_velocity_features_with_history(data, history,
+                                           windows=WINDOWS_MIN):
+    """Compute the velocity features given the recent transactions history.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The data, newer than the history.
+    history : pandas.DataFrame
+        The ``credit_card_number``, ``timestamp``, ``Amount`` and
+        ``merchant`` of the history transactions within the largest window
+        before the data.
+    windows : list[float]
+        The window sizes.
+
+    Returns
+    -------
+    velocity_features : pandas.DataFrame
+        The velocity features, indexed as ``data``.
+    """
+    history = history[history['credit_card_number'].isin(
+        data['credit_card_number'])]
+
+    velocity_features = compute_velocity_features(
+        pd.concat([
+            data[history.columns.tolist()],
+            history
+        ], ignore_index=True),
+        windows=windows
+    ).iloc[:len(data)]
+    velocity_features.index = data.index
+
+    return velocity_features
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Stage level timing and profiling of the processing pipelines.
+
+Stages are wrapped in spans, which measure the wall time, the CPU time,
+the rows processed and the RSS of the process at the start and the end of
+the stage, and its peak sampled every ``RSS_SAMPLE_INTERVAL_SEC`` during
+the stage. The CPU time is the one of the whole process, summed over its
+threads, so concurrent spans count each other's CPU time. The RSS is also
+the one of the whole process. Each finished span is logged as a
+JSON record by the ``fraud_prevention.metrics`` logger and, if the
+``FRAUD_PREVENTION_METRICS_PATH`` environment variable is set, appended
+to that JSON lines file.
+
+Set ``FRAUD_PREVENTION_PROFILE`` to ``cprofile`` or ``pyinstrument`` to
+profile the outermost spans, the profiles are written to
+``FRAUD_PREVENTION_PROFILE_DIR``.
+
+Usage::
+
+    FRAUD_PREVENTION_METRICS_PATH=metrics.jsonl \
+        python -c "from fraud_prevention.features import \
+            cc_transaction_features; cc_transaction_features.process()"
+
+    {"span": "cc_transaction_features.process/load", "wall_sec": 1.52, ...}
+    {"span": "cc_transaction_features.process/woe", "wall_sec": 0.31, ...}
+"""
+import os
+import json
+import time
+import logging
+import resource
+import threading
+import functools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from fraud_prevention import config
+
+METRICS_PATH_ENV = 'FRAUD_PREVENTION_METRICS_PATH'
+PROFILE_ENV = 'FRAUD_PREVENTION_PROFILE'
+PROFILE_DIR_ENV = 'FRAUD_PREVENTION_PROFILE_DIR'
+
+PROFILE_DIR = os.path.join(config.PRJ_DIR, 'data/interim/profiles')
+
+# Seconds between the RSS samples of a span
+RSS_SAMPLE_INTERVAL_SEC = .01
+
+LOGGER = logging.getLogger('fraud_prevention.metrics')
+
+# The spans in progress of each thread, to name the nested ones
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class Span:
+    """A timed stage.
+
+    Parameters
+    ----------
+    name : str
+        The full span name, the nested spans are prefixed with the names
+        of the outer ones.
+    rows : int
+        The number of rows processed, can be set while the span runs.
+    """
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.metrics = {}
+
+    def to_dict(self):
+        """Get the span record.
+
+        Returns
+        -------
+        record : dict
+            The span name and metrics.
+        """
+        return {'span': self.name, 'rows': self.rows, **self.metrics}
+
+
+def get_rss_mb():
+    """Get the current resident set size of the process.
+
+    Returns
+    -------
+    rss_mb : float
+        The process RSS in MB, None where ``/proc`` is not available.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return pages * resource.getpagesize() / 2 ** 20
+
+
+class PeakRssSampler:
+    """Sample the peak resident set size of the process during a block.
+
+    The RSS is sampled from a background thread, so the peak of the
+    native allocations is measured too, up to the sampling interval.
+
+    Parameters
+    ----------
+    interval : float
+        The seconds between two samples.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention import instrumentation
+
+        with instrumentation.PeakRssSampler() as sampler:
+            data = creditcard.get()
+
+        sampler.peak_rss_mb - sampler.start_rss_mb
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL_SEC):
+        self.interval = interval
+        self.start_rss_mb = None
+        self.end_rss_mb = None
+        self.peak_rss_mb = None
+
+        self._done = threading.Event()
+        self._thread = None
+
+    def _update(self):
+        rss = get_rss_mb()
+        if rss is not None:
+            self.peak_rss_mb = max(self.peak_rss_mb, rss)
+
+        return rss
+
+    def _sample(self):
+        while not self._done.wait(self.interval):
+            self._update()
+
+    def __enter__(self):
+        self.start_rss_mb = self.peak_rss_mb = get_rss_mb()
+        if self.start_rss_mb is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+            self.end_rss_mb = self._update()
+
+        return False
+
+
+def emit(record):
+    """Log a span record and append it to the metrics file, if any.
+
+    Parameters
+    ----------
+    record : dict
+        The span record.
+    """
+    line = json.dumps(record, default=str)
+    LOGGER.info(line)
+
+    path = os.environ.get(METRICS_PATH_ENV)
+    if path:
+        with _lock, open(path, 'a') as f:
+            f.write(line + '\n')
+
+
+@contextmanager
+def profile(name):
+    """Profile a block with the profiler of ``FRAUD_PREVENTION_PROFILE``.
+
+    Parameters
+    ----------
+    name : str
+        The profile name, used in the output file name.
+    """
+    profiler_name = os.environ.get(PROFILE_ENV, '').lower()
+    if not profiler_name:
+        yield
+        return
+
+    profile_dir = os.environ.get(PROFILE_DIR_ENV, PROFILE_DIR)
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(
+        profile_dir,
+        '{}-{}'.format(
+            name.replace('/', '-'),
+            datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')))
+
+    if profiler_name == 'cprofile':
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(f'{path}.prof')
+
+    elif profiler_name == 'pyinstrument':
+        from pyinstrument import Profiler
+
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(f'{path}.html', 'w') as f:
+                f.write(profiler.output_html())
+
+    else:
+        raise ValueError(
+            f'Unknown {PROFILE_ENV} {profiler_name}, '
+            "expected 'cprofile' or 'pyinstrument'")
+
+
+@contextmanager
+def span(name, rows=None):
+    """Time a stage.
+
+    Parameters
+    ----------
+    name : str
+        The stage name.
+    rows : int
+        The number of rows processed, can also be set on the yielded span.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention import instrumentation
+
+        with instrumentation.span('load') as s:
+            data = creditcard.get()
+            s.rows = len(data)
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    current = Span(
+        f'{stack[-1].name}/{name}' if stack else name,
+        rows=rows)
+
+    stack.append(current)
+    rss_sampler = PeakRssSampler()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        with rss_sampler:
+            if len(stack) == 1:
+                with profile(current.name):
+                    yield current
+            else:
+                yield current
+    finally:
+        stack.pop()
+
+        wall_sec = time.perf_counter() - start_wall
+        cpu_sec = time.process_time() - start_cpu
+        start_rss = rss_sampler.start_rss_mb
+        end_rss = rss_sampler.end_rss_mb
+        current.metrics = {
+            'wall_sec': wall_sec,
+            'cpu_sec': cpu_sec,
+            'rows_per_sec': (
+                current.rows / wall_sec
+                if current.rows is not None and wall_sec > 0 else None),
+            'start_rss_mb': start_rss,
+            'end_rss_mb': end_rss,
+            'rss_delta_mb': (
+                end_rss - start_rss
+                if start_rss is not None and end_rss is not None else None),
+            'peak_rss_mb': rss_sampler.peak_rss_mb,
+            'pid': os.getpid(),
+            'finished_at': datetime.now(timezone.utc).isoformat()
+        }
+        emit(current.to_dict())
+
+
+def instrument(name=None):
+    """Decorate a function to time each call in a span.
+
+    The rows processed are the length of the first argument, if any.
+
+    Parameters
+    ----------
+    name : str
+        The span name, by default the function qualified name.
+    """
+    def decorator(func):
+        span_name = name or f'{func.__module__.split(".")[-1]}.{func.__name__}'
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows = None
+            if args and hasattr(args[0], '__len__'):
+                rows = len(args[0])
+
+            with span(span_name, rows=rows):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
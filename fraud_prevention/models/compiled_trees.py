@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Array based inference of the boosted model pipelines.
+
+The trees of a fitted ``xgb`` or ``lightgbm`` pipeline of
+``model_experiment.get_model_candidates`` are exported to flat node
+arrays (feature, threshold, children, missing value direction and leaf
+value), evaluated for a batch of transactions with a few NumPy
+operations per tree level, only for the trees not yet at a leaf.
+Scoring only needs NumPy, without the per-call validation of the sklearn
+pipeline, and the compiled model is persisted as a ``.npz`` file.
+
+Usage::
+
+    from fraud_prevention.models import compiled_trees
+    from fraud_prevention.models import model_experiment
+
+    pipeline = model_experiment.load_model()
+
+    compiled = compiled_trees.compile_pipeline(pipeline)
+    compiled_trees.check_parity(pipeline, compiled, X_test)
+    compiled.save(compiled_trees.COMPILED_MODEL_PATH)
+
+    compiled_trees.CompiledTreeEnsemble.load(
+        compiled_trees.COMPILED_MODEL_PATH).predict_proba(X)[:, 1]
+"""
+import os
+import json
+
+import numpy as np
+from sklearn.impute import SimpleImputer
+from xgboost import XGBClassifier
+from lightgbm import LGBMClassifier
+
+from fraud_prevention import config
+
+COMPILED_MODEL_PATH = os.path.join(
+    config.PRJ_DIR,
+    'models/model_compiled.npz')
+
+# Missing value types of the nodes, as in LightGBM
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+
+# LightGBM zero threshold of the Zero missing type
+ZERO_THRESHOLD = 1e-35
+
+# Rows per traversal chunk, times the number of trees
+MAX_CHUNK_NODES = 2 ** 22
+
+
+class CompiledTreeEnsemble:
+    """A binary tree ensemble as flat node arrays.
+
+    The nodes of every tree are concatenated and all the trees are
+    traversed at once, one level per step, only the (transaction, tree)
+    pairs not yet at a leaf move down. A transaction goes to the left
+    child when its feature is ``< threshold`` (``decision_type='<'``,
+    XGBoost) or ``<= threshold`` (``decision_type='<='``, LightGBM), and
+    missing values follow ``default_left``.
+
+    Parameters
+    ----------
+    feature : numpy.ndarray
+        The split feature index of each node, 0 for the leaves.
+    threshold : numpy.ndarray
+        The split threshold of each node.
+    left : numpy.ndarray
+        The left child of each node, the node itself for the leaves.
+    right : numpy.ndarray
+        The right child of each node, the node itself for the leaves.
+    default_left : numpy.ndarray
+        Whether the missing values of each node go to the left child.
+    missing_type : numpy.ndarray
+        The missing value type of each node, ``MISSING_NONE`` treats NaN
+        as 0, ``MISSING_ZERO`` treats 0 and NaN as missing and
+        ``MISSING_NAN`` treats NaN as missing.
+    value : numpy.ndarray
+        The leaf value of each node, 0 for the split nodes.
+    roots : numpy.ndarray
+        The root node of each tree.
+    max_depth : int
+        The depth of the deepest tree.
+    base_score : float
+        The raw score added to the sum of the leaf values.
+    decision_type : str
+        ``<`` or ``<=``.
+    sigmoid : float
+        The raw score scale of the sigmoid.
+    fill_value : numpy.ndarray
+        The imputed value of the missing values of each feature, NaN to
+        leave them missing.
+    feature_names : list[str]
+        The model features, in the model input column order.
+    dtype : str
+        The float type of the comparisons, ``float32`` for XGBoost.
+    """
+
+    ARRAYS = [
+        'feature', 'threshold', 'left', 'right', 'default_left',
+        'missing_type', 'value', 'roots', 'fill_value']
+
+    def __init__(self, feature, threshold, left, right, default_left,
+                 missing_type, value, roots, max_depth, base_score=0.,
+                 decision_type='<=', sigmoid=1., fill_value=None,
+                 feature_names=None, dtype='float64'):
+        if decision_type not in ('<', '<='):
+            raise ValueError(
+                f"Unknown decision_type {decision_type}, expected '<' or "
+                "'<='")
+
+        self.dtype = np.dtype(dtype)
+        self.feature = np.asarray(feature, dtype=np.int32)
+        self.threshold = np.asarray(threshold, dtype=self.dtype)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.right = np.asarray(right, dtype=np.int32)
+        self.default_left = np.asarray(default_left, dtype=bool)
+        self.missing_type = np.asarray(missing_type, dtype=np.int8)
+        self.value = np.asarray(value, dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.int32)
+        self.max_depth = int(max_depth)
+        self.base_score = float(base_score)
+        self.decision_type = decision_type
+        self.sigmoid = float(sigmoid)
+        self.feature_names = (
+            None if feature_names is None else list(feature_names))
+
+        n_features = (
+            len(self.feature_names) if self.feature_names is not None
+            else int(self.feature.max(initial=-1)) + 1)
+        self.fill_value = (
+            np.full(n_features, np.nan) if fill_value is None
+            else np.asarray(fill_value, dtype=np.float64))
+
+        # The missing value checks are skipped when no node needs them
+        self._has_zero_missing = bool(
+            (self.missing_type == MISSING_ZERO).any())
+        self._has_fill_value = bool((~np.isnan(self.fill_value)).any())
+
+        # The right and the left child of each node, for one gather per
+        # level, as intp not to cast the gather indices
+        self._children = np.column_stack(
+            [self.right, self.left]).ravel().astype(np.intp)
+        self._is_leaf = self.left == np.arange(len(self.left))
+
+        # The direction of NaN at each node, compared as 0 for the nodes
+        # without missing values
+        zero_left = 0 < self.threshold if self.decision_type == '<' \
+            else 0 <= self.threshold
+        self._nan_left = np.where(
+            self.missing_type == MISSING_NONE, zero_left, self.default_left)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def _get_leaves(self, X):
+        nodes = np.tile(self.roots.astype(np.intp), len(X))
+
+        # Without missing values, the nodes only compare the thresholds
+        has_missing = self._has_zero_missing or bool(np.isnan(X).any())
+
+        # The (row, tree) pairs not yet at a leaf, the trees of a row are
+        # contiguous. The traversal stops when all of them reached a leaf,
+        # the shallow trees and branches are not walked to max_depth
+        active = np.flatnonzero(~self._is_leaf[nodes])
+        offset = active // self.n_trees * X.shape[1]
+        X_flat = X.ravel()
+        while len(active):
+            node = nodes[active]
+            x = X_flat[offset + self.feature[node]]
+            threshold = self.threshold[node]
+
+            go_left = x < threshold if self.decision_type == '<' \
+                else x <= threshold
+            if has_missing:
+                go_left = np.where(
+                    np.isnan(x), self._nan_left[node], go_left)
+                if self._has_zero_missing:
+                    is_zero = (
+                        (self.missing_type[node] == MISSING_ZERO) &
+                        (np.abs(x) <= ZERO_THRESHOLD))
+                    go_left = np.where(
+                        is_zero, self.default_left[node], go_left)
+
+            node = self._children[2 * node + go_left]
+            nodes[active] = node
+
+            is_split = ~self._is_leaf[node]
+            active, offset = active[is_split], offset[is_split]
+
+        return nodes.reshape(len(X), self.n_trees)
+
+    def decision_function(self, X):
+        """Get the raw scores of the transactions.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The features, one row per transaction in the ``feature_names``
+            column order.
+
+        Returns
+        -------
+        raw_score : numpy.ndarray
+            The raw score of each transaction.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[1] != len(self.fill_value):
+            raise ValueError(
+                f'Expected an array of shape (n, {len(self.fill_value)}),'
+                f' got {X.shape}')
+
+        if self._has_fill_value:
+            X = np.where(np.isnan(X), self.fill_value, X)
+        X = np.ascontiguousarray(X, dtype=self.dtype)
+
+        chunk_size = max(1, MAX_CHUNK_NODES // max(self.n_trees, 1))
+        raw_score = np.empty(len(X))
+        for start in range(0, len(X), chunk_size):
+            leaves = self._get_leaves(X[start:start + chunk_size])
+            raw_score[start:start + chunk_size] = \
+                self.value[leaves].sum(axis=1)
+
+        return raw_score + self.base_score
+
+    def predict_proba(self, X):
+        """Get the class probabilities of the transactions.
+
+        Parameters
+        ----------
+        X : numpy.ndarray
+            The features, one row per transaction in the ``feature_names``
+            column order.
+
+        Returns
+        -------
+        proba : numpy.ndarray
+            The probability of the negative and the positive class of each
+            transaction, as ``predict_proba`` of the pipeline.
+        """
+        proba = 1 / (1 + np.exp(-self.sigmoid * self.decision_function(X)))
+
+        return np.column_stack([1 - proba, proba])
+
+    def save(self, path=COMPILED_MODEL_PATH):
+        """Persist the compiled model.
+
+        Parameters
+        ----------
+        path : str
+            The ``.npz`` file path.
+        """
+        np.savez(
+            path,
+            **{name: getattr(self, name) for name in self.ARRAYS},
+            params=json.dumps({
+                'max_depth': self.max_depth,
+                'base_score': self.base_score,
+                'decision_type': self.decision_type,
+                'sigmoid': self.sigmoid,
+                'feature_names': self.feature_names,
+                'dtype': self.dtype.name
+            }))
+
+    @classmethod
+    def load(cls, path=COMPILED_MODEL_PATH):
+        """Load a persisted compiled model.
+
+        Parameters
+        ----------
+        path : str
+            The ``.npz`` file path.
+
+        Returns
+        -------
+        compiled : CompiledTreeEnsemble
+            The compiled model.
+        """
+        with np.load(path) as arrays:
+            return cls(
+                **{name: arrays[name] for name in cls.ARRAYS},
+                **json.loads(str(arrays['params'])))
+
+
+def get_xgb_arrays(model):
+    """Export the trees of a fitted XGBoost classifier.
+
+    Parameters
+    ----------
+    model : xgboost.XGBClassifier
+        The fitted binary classifier.
+
+    Returns
+    -------
+    kwargs : dict
+        The ``CompiledTreeEnsemble`` arguments.
+    """
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw(raw_format='json'))['learner']
+
+    if learner['objective']['name'] != 'binary:logistic':
+        raise ValueError(
+            f"Unsupported objective {learner['objective']['name']}")
+    if learner['gradient_booster']['name'] != 'gbtree':
+        raise ValueError(
+            f"Unsupported booster {learner['gradient_booster']['name']}")
+
+    trees = learner['gradient_booster']['model']['trees']
+
+    # Predictions use the trees up to the early stopping best iteration
+    best_iteration = booster.attr('best_iteration')
+    if best_iteration is not None:
+        trees = trees[:int(best_iteration) + 1]
+
+    nodes = {name: [] for name in [
+        'feature', 'threshold', 'left', 'right', 'default_left', 'value']}
+    roots, max_depth, offset = [], 0, 0
+    for tree in trees:
+        if any(tree['split_type']):
+            raise ValueError('Categorical splits are not supported.')
+
+        left = np.asarray(tree['left_children'])
+        right = np.asarray(tree['right_children'])
+        is_leaf = left == -1
+        index = np.arange(len(left))
+
+        nodes['feature'].append(
+            np.where(is_leaf, 0, tree['split_indices']))
+        nodes['threshold'].append(
+            np.where(is_leaf, np.nan, tree['split_conditions']))
+        nodes['left'].append(offset + np.where(is_leaf, index, left))
+        nodes['right'].append(offset + np.where(is_leaf, index, right))
+        nodes['default_left'].append(np.asarray(tree['default_left']) == 1)
+        nodes['value'].append(np.where(is_leaf, tree['split_conditions'], 0))
+
+        roots.append(offset)
+        max_depth = max(max_depth, get_max_depth(left, right))
+        offset += len(left)
+
+    # Stored in probability space, e.g. '[5E-1]'
+    base_score = float(
+        learner['learner_model_param']['base_score'].strip('[]'))
+
+    return dict(
+        **{name: np.concatenate(arrays) if arrays else np.empty(0)
+           for name, arrays in nodes.items()},
+        missing_type=np.full(offset, MISSING_NAN),
+        roots=roots,
+        max_depth=max_depth,
+        base_score=np.log(base_score / (1 - base_score)),
+        decision_type='<',
+        sigmoid=1.,
+        feature_names=learner['feature_names'] or None,
+        dtype='float32')
+
+
+def get_lightgbm_arrays(model):
+    """Export the trees of a fitted LightGBM classifier.
+
+    Parameters
+    ----------
+    model : lightgbm.LGBMClassifier
+        The fitted binary classifier.
+
+    Returns
+    -------
+    kwargs : dict
+        The ``CompiledTreeEnsemble`` arguments.
+    """
+    # The best iteration trees, if any
+    dump = model.booster_.dump_model()
+
+    objective = dump['objective'].split()
+    if objective[0] != 'binary':
+        raise ValueError(f"Unsupported objective {dump['objective']}")
+    sigmoid = float(dict(
+        p.split(':') for p in objective[1:]).get('sigmoid', 1.))
+
+    nodes = {name: [] for name in [
+        'feature', 'threshold', 'left', 'right', 'default_left',
+        'missing_type', 'value']}
+    missing_types = {
+        'None': MISSING_NONE, 'Zero': MISSING_ZERO, 'NaN': MISSING_NAN}
+
+    def add_node(node):
+        i = len(nodes['value'])
+        for name in nodes:
+            nodes[name].append(0)
+
+        if 'leaf_value' in node:
+            nodes['left'][i] = nodes['right'][i] = i
+            nodes['threshold'][i] = np.nan
+            nodes['value'][i] = node['leaf_value']
+            return i, 0
+
+        if node['decision_type'] != '<=':
+            raise ValueError('Categorical splits are not supported.')
+
+        nodes['feature'][i] = node['split_feature']
+        nodes['threshold'][i] = node['threshold']
+        nodes['default_left'][i] = node['default_left']
+        nodes['missing_type'][i] = missing_types[node['missing_type']]
+        nodes['left'][i], left_depth = add_node(node['left_child'])
+        nodes['right'][i], right_depth = add_node(node['right_child'])
+
+        return i, 1 + max(left_depth, right_depth)
+
+    roots, max_depth = [], 0
+    for tree in dump['tree_info']:
+        root, depth = add_node(tree['tree_structure'])
+        roots.append(root)
+        max_depth = max(max_depth, depth)
+
+    return dict(
+        **nodes,
+        roots=roots,
+        max_depth=max_depth,
+        base_score=0.,
+        decision_type='<=',
+        sigmoid=sigmoid,
+        feature_names=dump['feature_names'],
+        dtype='float64')
+
+
+def get_max_depth(left, right):
+    """Get the depth of a tree.
+
+    Parameters
+    ----------
+    left : numpy.ndarray
+        The left child of each node, -1 for the leaves.
+    right : numpy.ndarray
+        The right child of each node, -1 for the leaves.
+
+    Returns
+    -------
+    max_depth : int
+        The number of splits from the root to the deepest leaf.
+    """
+    level, max_depth = np.array([0]), 0
+    while True:
+        level = np.concatenate([left[level], right[level]])
+        level = level[level >= 0]
+        if len(level) == 0:
+            return max_depth
+        max_depth += 1
+
+
+def compile_pipeline(pipeline):
+    """Compile a fitted boosted model pipeline.
+
+    The imputers of the pipeline are applied before the traversal, the
+    resampling steps (SMOTE) only apply to the fit and are skipped.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline, with a ``XGBClassifier`` or
+        ``LGBMClassifier`` ``model`` step.
+
+    Returns
+    -------
+    compiled : CompiledTreeEnsemble
+        The compiled model.
+    """
+    fill_value = None
+    for name, step in pipeline.steps[:-1]:
+        if hasattr(step, 'fit_resample'):
+            continue
+
+        if not isinstance(step, SimpleImputer) or not np.isnan(
+                step.missing_values):
+            raise TypeError(f'Unsupported pipeline step {name}')
+
+        if fill_value is not None:
+            raise TypeError('Only one imputer step is supported.')
+        fill_value = step.statistics_
+
+    model = pipeline.steps[-1][1]
+    if isinstance(model, XGBClassifier):
+        kwargs = get_xgb_arrays(model)
+    elif isinstance(model, LGBMClassifier):
+        kwargs = get_lightgbm_arrays(model)
+    else:
+        raise TypeError(f'Unsupported model {type(model)}')
+
+    return CompiledTreeEnsemble(fill_value=fill_value, **kwargs)
+
+
+def check_parity(pipeline, compiled, X, atol=1e-6):
+    """Check the compiled model scores against the pipeline scores.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline.
+    compiled : CompiledTreeEnsemble
+        The compiled pipeline.
+    X : pandas.DataFrame
+        The features, e.g. the test partition of ``dataset.get``.
+    atol : float
+        The maximum absolute difference of the fraud probabilities.
+
+    Returns
+    -------
+    max_diff : float
+        The maximum absolute difference of the fraud probabilities.
+    """
+    expected = pipeline.predict_proba(X)[:, 1]
+    actual = compiled.predict_proba(np.asarray(X, dtype=float))[:, 1]
+
+    max_diff = float(np.max(np.abs(expected - actual), initial=0.))
+    if max_diff > atol:
+        raise ValueError(
+            f'The compiled model scores differ from the pipeline scores by '
+            f'up to {max_diff}, above {atol}')
+
+    return max_diff
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Successive halving search over the candidate models.
+
+Every configuration of the ``model_experiment.get_model_candidates`` grids
+is a trial. All the trials start with a small budget, only the best
+``1 / eta`` of each rung are trained again with ``eta`` times the budget,
+until the remaining trials get the full budget. The budget is the number
+of training rows for all the candidates, so the boosted and the linear
+models of a rung are compared with the same training data.
+
+The trials of a rung run over a pool of processes, each one reading the
+splits from the shared memory-mapped dataset cache and training with
+``n_threads`` threads.
+
+Usage::
+
+    python -m fraud_prevention.models.hyperparameter_search \
+        --n-jobs 4 --n-threads 2
+"""
+import os
+import json
+import math
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid
+from sklearn.metrics import roc_auc_score, average_precision_score, f1_score
+from threadpoolctl import threadpool_limits
+
+from fraud_prevention import config
+from fraud_prevention import instrumentation
+from fraud_prevention.features import dataset
+from fraud_prevention.models import model_experiment
+
+RESULTS_PATH = os.path.join(
+    config.PRJ_DIR,
+    'models/hyperparameter_search.parquet')
+
+SCORINGS = ['roc_auc', 'average_precision', 'f1']
+
+
+def get_trials(pipelines, param_grids):
+    """Get the trials of the candidate models.
+
+    Parameters
+    ----------
+    pipelines : dict[sklearn.pipeline.Pipeline]
+        The model pipelines.
+    param_grids : dict
+        The parameter grid of each pipeline.
+
+    Returns
+    -------
+    trials : list[dict]
+        The candidate name and parameters of each trial.
+    """
+    return [
+        {'candidate': candidate, 'params': params}
+        for candidate in pipelines
+        for params in ParameterGrid(param_grids.get(candidate, {}))
+    ]
+
+
+def get_rungs(nb_trials, eta=3, min_fraction=None):
+    """Get the budget fractions of the successive halving rungs.
+
+    Parameters
+    ----------
+    nb_trials : int
+        The number of trials of the first rung.
+    eta : int
+        The budget factor between rungs, only the best ``1 / eta`` of the
+        trials of a rung go to the next one.
+    min_fraction : float
+        The smallest budget fraction of the first rung, the first rung gets
+        the largest power of ``1 / eta`` at most ``min_fraction``. By
+        default the first rung leaves at least ``eta`` trials in the last
+        rung.
+
+    Returns
+    -------
+    fractions : list[float]
+        The budget fraction of each rung, the last one is 1.
+    """
+    # Counted with integers, float logs truncate e.g. log(243, 3) to 4
+    nb_rungs = 1
+    if min_fraction is None:
+        while eta ** (nb_rungs + 1) <= nb_trials:
+            nb_rungs += 1
+    else:
+        if not 0 < min_fraction <= 1:
+            raise ValueError(
+                f'min_fraction must be in (0, 1], got {min_fraction}')
+        while min_fraction * eta ** (nb_rungs - 1) < 1:
+            nb_rungs += 1
+
+    return [float(eta) ** (r - nb_rungs + 1) for r in range(nb_rungs)]
+
+
+def run_trial(trial, fraction, dataset_kwargs=None, n_threads=1,
+              return_estimator=False):
+    """Train and score a trial on the validation split.
+
+    Parameters
+    ----------
+    trial : dict
+        The candidate name and parameters.
+    fraction : float
+        The budget fraction.
+    dataset_kwargs : dict
+        The ``dataset.get`` arguments, the splits are read from the cache.
+    n_threads : int
+        The number of threads of the trial.
+    return_estimator : bool
+        Set to True returns the fitted pipeline with the results.
+
+    Returns
+    -------
+    result : dict
+        The trial, its budget, the validation scores, the fit time and the
+        error of a failed trial.
+    """
+    (
+        X_train, _, X_val,
+        y_train, _, y_val,
+        _, _, _
+    ) = dataset.get(cache=True, **(dataset_kwargs or {}))
+
+    pipelines, _ = model_experiment.get_model_candidates()
+    pipeline = clone(pipelines[trial['candidate']])
+
+    nb_rows = max(1, int(round(len(X_train) * fraction)))
+
+    params = trial['params']
+    if 'model__n_jobs' in pipeline.get_params():
+        params = {**params, 'model__n_jobs': n_threads}
+    pipeline.set_params(**params)
+
+    # The training split is already shuffled, its head is a random sample.
+    # A trial failing on a small budget, e.g. SMOTE with too few frauds,
+    # gets NaN scores as with the scikit-learn searches
+    start = time.perf_counter()
+    error = None
+    try:
+        with threadpool_limits(limits=n_threads):
+            pipeline.fit(X_train.iloc[:nb_rows], y_train.iloc[:nb_rows])
+            y_score = pipeline.predict_proba(X_val)[:, 1]
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    fit_time = time.perf_counter() - start
+
+    result = {
+        'candidate': trial['candidate'],
+        'params': json.dumps(trial['params'], sort_keys=True, default=str),
+        'fraction': fraction,
+        'nb_rows': nb_rows,
+        'roc_auc': np.nan,
+        'average_precision': np.nan,
+        'f1': np.nan,
+        'fit_time': fit_time,
+        'error': error
+    }
+    if error is None:
+        result.update({
+            'roc_auc': roc_auc_score(y_val, y_score),
+            'average_precision': average_precision_score(y_val, y_score),
+            'f1': f1_score(y_val, y_score >= .5)
+        })
+
+    if return_estimator:
+        return result, pipeline
+
+    return result
+
+
+@instrumentation.instrument('hyperparameter_search.run')
+def run(candidates=None, eta=3, min_fraction=None, scoring='roc_auc',
+        n_jobs=None, n_threads=1, dataset_kwargs=None,
+        results_path=RESULTS_PATH, model_path=model_experiment.MODEL_PATH,
+        verbose=True):
+    """Search the best candidate model with successive halving.
+
+    The trials are scored on the validation split, the test split is left
+    for the evaluation of the best pipeline.
+
+    Parameters
+    ----------
+    candidates : list[str]
+        The candidate names of ``model_experiment.get_model_candidates``,
+        by default all of them.
+    eta : int
+        The budget factor between rungs.
+    min_fraction : float
+        The budget fraction of the first rung, see ``get_rungs``.
+    scoring : str
+        The validation score selecting the trials, one of ``SCORINGS``.
+    n_jobs : int
+        The number of worker processes, None to use all the CPUs divided
+        by ``n_threads``.
+    n_threads : int
+        The number of threads of each trial.
+    dataset_kwargs : dict
+        The ``dataset.get`` arguments.
+    results_path : str
+        The parquet file of the results of every trial, None to skip it.
+    model_path : str
+        The file of the best pipeline, None to skip it.
+    verbose : bool
+        Set to True prints the progress of each rung.
+
+    Returns
+    -------
+    results : pandas.DataFrame
+        The results of every trial of every rung.
+    best_pipeline : sklearn.pipeline.Pipeline
+        The best pipeline, fitted with the full budget.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.models import hyperparameter_search
+
+        results, best_pipeline = hyperparameter_search.run(
+            n_jobs=4,
+            n_threads=2,
+            dataset_kwargs={'test_size': 0.1, 'val_size': .3})
+
+        results.sort_values('roc_auc', ascending=False).head()
+    """
+    if scoring not in SCORINGS:
+        raise ValueError(f'Unknown scoring {scoring}, expected {SCORINGS}')
+
+    if n_jobs is None:
+        n_jobs = max(1, (os.cpu_count() or 1) // n_threads)
+
+    pipelines, param_grids = model_experiment.get_model_candidates()
+    if candidates is not None:
+        pipelines = {c: pipelines[c] for c in candidates}
+
+    trials = get_trials(pipelines, param_grids)
+    fractions = get_rungs(len(trials), eta=eta, min_fraction=min_fraction)
+
+    # Build the cache once, before the workers read it
+    with instrumentation.span('load'):
+        dataset.get(cache=True, **(dataset_kwargs or {}))
+
+    results = []
+    best_pipeline = None
+    with Parallel(n_jobs=n_jobs, backend='loky') as parallel:
+        for rung, fraction in enumerate(fractions):
+            is_last = rung == len(fractions) - 1
+
+            with instrumentation.span(f'rung_{rung}', rows=len(trials)):
+                outputs = parallel(
+                    delayed(run_trial)(
+                        trial,
+                        fraction,
+                        dataset_kwargs=dataset_kwargs,
+                        n_threads=n_threads,
+                        return_estimator=is_last)
+                    for trial in trials)
+
+            if is_last:
+                outputs, fitted = zip(*outputs)
+
+            rung_results = pd.DataFrame(list(outputs)).assign(rung=rung)
+            results.append(rung_results)
+
+            order = np.argsort(-rung_results[scoring].fillna(-np.inf).values,
+                               kind='stable')
+
+            if verbose:
+                best = rung_results.iloc[order[0]]
+                print(
+                    f'Rung {rung}: {len(trials)} trials with '
+                    f'{fraction:.3g} of the budget, best {best["candidate"]}'
+                    f' {scoring}={best[scoring]:.4f}')
+
+            if is_last:
+                best_pipeline = fitted[order[0]]
+            else:
+                trials = [
+                    trials[i]
+                    for i in order[:max(1, math.ceil(len(trials) / eta))]
+                ]
+
+    results = pd.concat(results, ignore_index=True)
+
+    if results_path is not None:
+        results.to_parquet(results_path)
+    if model_path is not None:
+        model_experiment.save_model(best_pipeline, model_path)
+
+    return results, best_pipeline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--candidates', nargs='+', default=None)
+    parser.add_argument('--eta', type=int, default=3)
+    parser.add_argument('--min-fraction', type=float, default=None)
+    parser.add_argument('--scoring', choices=SCORINGS, default='roc_auc')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--n-threads', type=int, default=1)
+    parser.add_argument('--results-path', default=RESULTS_PATH)
+    parser.add_argument('--model-path', default=model_experiment.MODEL_PATH)
+    args = parser.parse_args()
+
+    results, _ = run(
+        candidates=args.candidates,
+        eta=args.eta,
+        min_fraction=args.min_fraction,
+        scoring=args.scoring,
+        n_jobs=args.n_jobs,
+        n_threads=args.n_threads,
+        results_path=args.results_path,
+        model_path=args.model_path)
+
+    print(results.sort_values(
+        ['rung', args.scoring],
+        ascending=[True, False]).to_string())
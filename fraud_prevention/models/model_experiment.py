@@ -2,17 +2,19 @@
 # -*- coding: utf-8 -*-
 import os
 
+import joblib
 import numpy as np
 from sklearn.pipeline import Pipeline
 from sklearn.impute import SimpleImputer
 from sklearn.preprocessing import StandardScaler
 from sklearn.linear_model import LogisticRegression
 from xgboost import XGBClassifier
-from lightgbm import LGBMClassifier
+from lightgbm import LGBMClassifier, early_stopping
 from imblearn.over_sampling import SMOTE
 from imblearn.pipeline import Pipeline as ImbPipeline
 
 from fraud_prevention import config
+from fraud_prevention.features import dataset
 
 
 X_PATH = os.path.join(
@@ -27,6 +29,16 @@ X_SHAP_VALUES_PATH = os.path.join(
     config.PRJ_DIR,
     'models/X_SHAP_VALUES_PATH.parquet')
 
+MODEL_PATH = os.path.join(
+    config.PRJ_DIR,
+    'models/model.joblib')
+
+# Early stopping metric names of each library
+EVAL_METRICS = {
+    'auc': {'xgb': 'auc', 'lightgbm': 'auc'},
+    'pr_auc': {'xgb': 'aucpr', 'lightgbm': 'average_precision'}
+}
+
 
 def get_model_candidates():
     """Get the candidate models to test.
@@ -135,3 +147,192 @@ def get_model_candidates():
     }
 
     return pipelines, param_grids
+
+
+def fit_early_stopping(pipeline, X_train, y_train, X_val, y_val,
+                       eval_metric='auc', early_stopping_rounds=50):
+    """Fit a boosted model pipeline with early stopping on the validation.
+
+    The steps before the model are fitted on the train partition and
+    applied to the validation partition, the resampling steps (SMOTE)
+    only resample the train partition. The model is then trained with the
+    validation partition as the eval set, until ``eval_metric`` has not
+    improved for ``early_stopping_rounds`` rounds. Only the trees up to
+    the best iteration are kept, so inference is capped to them.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        The model pipeline, with a ``XGBClassifier`` or ``LGBMClassifier``
+        ``model`` step, e.g. the ``xgb`` or ``lightgbm`` candidates.
+    X_train : pandas.DataFrame
+        The train features.
+    y_train : pandas.Series
+        The train target.
+    X_val : pandas.DataFrame
+        The validation features.
+    y_val : pandas.Series
+        The validation target.
+    eval_metric : str
+        The early stopping metric, ``auc`` or ``pr_auc``.
+    early_stopping_rounds : int
+        The number of rounds without improvement stopping the training.
+
+    Returns
+    --------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline.
+    best_iteration : int
+        The number of trees kept.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import dataset
+        from fraud_prevention.models import model_experiment
+
+        (
+            X_train, X_test, X_val,
+            y_train, y_test, y_val,
+            w_train, w_test, w_val
+        ) = dataset.get(cache=True)
+
+        pipelines, _ = model_experiment.get_model_candidates()
+
+        pipeline, best_iteration = model_experiment.fit_early_stopping(
+            pipelines['lightgbm'].set_params(model__learning_rate=0.05),
+            X_train, y_train,
+            X_val, y_val,
+            eval_metric='pr_auc')
+    """
+    if eval_metric not in EVAL_METRICS:
+        raise ValueError(
+            f'Unknown eval_metric {eval_metric}, '
+            f'expected one of {list(EVAL_METRICS)}')
+
+    # Fit the steps before the model, resampling only the train partition
+    for name, step in pipeline.steps[:-1]:
+        if hasattr(step, 'fit_resample'):
+            X_train, y_train = step.fit_resample(X_train, y_train)
+        else:
+            X_train = step.fit_transform(X_train, y_train)
+            X_val = step.transform(X_val)
+
+    model = pipeline.steps[-1][1]
+
+    if isinstance(model, XGBClassifier):
+        model.set_params(
+            eval_metric=EVAL_METRICS[eval_metric]['xgb'],
+            early_stopping_rounds=early_stopping_rounds)
+        model.fit(X_train, y_train, eval_set=[(X_val, y_val)], verbose=False)
+
+        best_iteration = model.best_iteration + 1
+
+        # Keep the best trees, with the early stopping attributes
+        booster = model.get_booster()
+        best_booster = booster[:best_iteration]
+        best_booster.set_attr(**booster.attributes())
+        model._Booster = best_booster
+
+        # A refit of the pipeline has no eval set
+        model.set_params(early_stopping_rounds=None)
+
+    elif isinstance(model, LGBMClassifier):
+        # The booster is saved up to the best iteration
+        model.fit(
+            X_train,
+            y_train,
+            eval_set=[(X_val, y_val)],
+            eval_metric=EVAL_METRICS[eval_metric]['lightgbm'],
+            callbacks=[early_stopping(
+                early_stopping_rounds,
+                first_metric_only=True,
+                verbose=False)])
+
+        best_iteration = model.best_iteration_ or model.n_estimators
+
+    else:
+        raise TypeError(
+            f'Early stopping needs a boosted model, got {type(model)}')
+
+    return pipeline, best_iteration
+
+
+def train(candidate='lightgbm', params=None, eval_metric='auc',
+          early_stopping_rounds=50, dataset_kwargs=None,
+          model_path=MODEL_PATH):
+    """Train a boosted candidate with early stopping and persist it.
+
+    Parameters
+    ----------
+    candidate : str
+        The boosted candidate name of ``get_model_candidates``.
+    params : dict
+        The pipeline parameters, e.g. the best ones of the grid search.
+    eval_metric : str
+        The early stopping metric, ``auc`` or ``pr_auc``.
+    early_stopping_rounds : int
+        The number of rounds without improvement stopping the training.
+    dataset_kwargs : dict
+        The ``dataset.get`` arguments, the splits are read from the cache.
+    model_path : str
+        The file of the fitted pipeline, None to skip it.
+
+    Returns
+    --------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline.
+    best_iteration : int
+        The number of trees kept.
+    """
+    (
+        X_train, _, X_val,
+        y_train, _, y_val,
+        _, _, _
+    ) = dataset.get(cache=True, **(dataset_kwargs or {}))
+
+    pipelines, _ = get_model_candidates()
+    pipeline = pipelines[candidate].set_params(**(params or {}))
+
+    pipeline, best_iteration = fit_early_stopping(
+        pipeline,
+        X_train, y_train,
+        X_val, y_val,
+        eval_metric=eval_metric,
+        early_stopping_rounds=early_stopping_rounds)
+
+    if model_path is not None:
+        save_model(pipeline, model_path)
+
+    return pipeline, best_iteration
+
+
+def save_model(pipeline, path=MODEL_PATH):
+    """Persist a fitted model pipeline.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline, e.g. the best estimator of the grid
+        search over ``get_model_candidates``.
+    path : str
+        The file path.
+    """
+    joblib.dump(pipeline, path)
+
+
+def load_model(path=MODEL_PATH):
+    """Load a persisted model pipeline.
+
+    Parameters
+    ----------
+    path : str
+        The file path.
+
+    Returns
+    --------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline.
+    """
+    return joblib.load(path)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy as np
+from sklearn.model_selection import BaseCrossValidator
+
+
+class TimeSeriesSplit(BaseCrossValidator):
+    """Out-of-time cross-validation folds over the transaction timestamps.
+
+    The transactions are cut in ``n_splits + 1`` consecutive time blocks
+    with about the same number of transactions, transactions with the same
+    timestamp are always in the same block. The k-th fold tests on the
+    block ``k + 1`` and trains on the blocks before it (``expanding``) or
+    only on the block right before it (``blocked``).
+
+    The train transactions in the ``embargo`` time units before each test
+    block are dropped, so the look-back features of the test block (the
+    velocity windows and the merchant chargeback WOE time windows) are not
+    computed from the labels of the train transactions at the fold edge.
+
+    The folds are index arrays, the data of each fold is never copied.
+
+    Parameters
+    ----------
+    timestamps : numpy.ndarray or pandas.Series
+        The timestamp of each transaction, in the order of the rows of
+        the data to split.
+    n_splits : int
+        The number of folds.
+    mode : str
+        ``expanding`` trains on all the blocks before the test block,
+        ``blocked`` only on the block right before it.
+    embargo : float
+        The time gap between the train and the test transactions, in
+        timestamp units.
+
+    Example
+    -------
+    ::
+
+        from sklearn.model_selection import GridSearchCV
+        from fraud_prevention.features import dataset
+        from fraud_prevention.features import cc_transaction_features
+        from fraud_prevention.models import model_experiment
+        from fraud_prevention.models import model_selection
+
+        data = cc_transaction_features.get(
+            columns=dataset.FEATURES + ['timestamp', 'Class'])
+
+        pipelines, param_grids = model_experiment.get_model_candidates()
+
+        grid_search = GridSearchCV(
+            estimator=pipelines['lightgbm'],
+            param_grid=param_grids['lightgbm'],
+            scoring='roc_auc',
+            cv=model_selection.TimeSeriesSplit(
+                data['timestamp'],
+                n_splits=3,
+                embargo=cc_transaction_features.WINDOW_SIZE))
+
+        grid_search.fit(data[dataset.FEATURES], data['Class'])
+    """
+
+    def __init__(self, timestamps, n_splits=3, mode='expanding', embargo=0.):
+        if mode not in ('expanding', 'blocked'):
+            raise ValueError(
+                f"Unknown mode {mode}, expected 'expanding' or 'blocked'")
+        if n_splits < 1:
+            raise ValueError(f'n_splits must be at least 1, got {n_splits}')
+
+        self.timestamps = timestamps
+        self.n_splits = n_splits
+        self.mode = mode
+        self.embargo = embargo
+
+    def get_block_bounds(self):
+        """Get the start timestamp of each time block.
+
+        Returns
+        -------
+        bounds : numpy.ndarray
+            The ``n_splits + 2`` block bounds, the last one is after the
+            last timestamp.
+        """
+        return self._get_block_bounds(
+            np.sort(np.asarray(self.timestamps, dtype=float)))
+
+    def _get_block_bounds(self, sorted_timestamps):
+        if len(sorted_timestamps) == 0:
+            raise ValueError('Cannot split an empty dataset.')
+
+        positions = np.linspace(
+            0, len(sorted_timestamps), self.n_splits + 2).astype(int)[1:-1]
+
+        return np.concatenate([
+            sorted_timestamps[:1],
+            sorted_timestamps[positions],
+            [np.nextafter(sorted_timestamps[-1], np.inf)]
+        ])
+
+    def split(self, X=None, y=None, groups=None):
+        """Generate the train and test indices of each fold.
+
+        Parameters
+        ----------
+        X : array-like
+            The data, only checked against the number of timestamps.
+        y : array-like
+            Ignored.
+        groups : array-like
+            Ignored.
+
+        Yields
+        ------
+        train : numpy.ndarray
+            The positions of the train transactions.
+        test : numpy.ndarray
+            The positions of the test transactions.
+        """
+        timestamps = np.asarray(self.timestamps, dtype=float)
+        if X is not None and len(X) != len(timestamps):
+            raise ValueError(
+                f'Got {len(X)} rows for {len(timestamps)} timestamps.')
+
+        order = np.argsort(timestamps, kind='stable')
+        sorted_timestamps = timestamps[order]
+
+        bounds = self._get_block_bounds(sorted_timestamps)
+        offsets = np.searchsorted(sorted_timestamps, bounds, side='left')
+
+        for k in range(1, self.n_splits + 1):
+            test_start, test_stop = offsets[k], offsets[k + 1]
+
+            train_start = offsets[0] if self.mode == 'expanding' \
+                else offsets[k - 1]
+            train_stop = np.searchsorted(
+                sorted_timestamps,
+                bounds[k] - self.embargo,
+                side='left')
+            train_stop = max(train_start, min(train_stop, test_start))
+
+            if test_start == test_stop or train_start == train_stop:
+                raise ValueError(
+                    f'Fold {k - 1} is empty, use fewer splits or a '
+                    'smaller embargo.')
+
+            yield (
+                np.sort(order[train_start:train_stop]),
+                np.sort(order[test_start:test_stop]))
+
+    def get_n_splits(self, X=None, y=None, groups=None):
+        """Get the number of folds.
+
+        Returns
+        -------
+        n_splits : int
+            The number of folds.
+        """
+        return self.n_splits
+
+    def __repr__(self):
+        # Without the timestamps
+        return (
+            f'{type(self).__name__}(n_splits={self.n_splits}, '
+            f"mode='{self.mode}', embargo={self.embargo})")
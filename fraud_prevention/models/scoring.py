@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import time
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from threadpoolctl import threadpool_limits
+
+from fraud_prevention.features import dataset
+from fraud_prevention.features import storage
+from fraud_prevention.models import model_experiment
+
+LOGGER = logging.getLogger(__name__)
+
+
+def map_bounded(executor, func, iterable, max_pending):
+    """Map a function over an iterable with a bounded number of futures.
+
+    Unlike ``executor.map``, the iterable is consumed only as the results
+    are collected, so at most ``max_pending`` items are in memory.
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        The executor.
+    func : callable
+        The function.
+    iterable : iterable
+        The function inputs.
+    max_pending : int
+        The maximum number of submitted and not yet collected calls.
+
+    Yields
+    ------
+    result : object
+        The result of each call, in the order of the inputs.
+    """
+    pending = deque()
+    for item in iterable:
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, item))
+
+    while pending:
+        yield pending.popleft().result()
+
+
+class BatchScorer:
+    """Score transactions in fixed-size micro-batches.
+
+    The model pipeline is loaded once, the inputs are converted once to a
+    float matrix in the ``features`` column order and scored with
+    ``predict_proba`` one micro-batch at a time, optionally over a pool
+    of threads.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline
+        The fitted model pipeline, by default the one persisted in
+        ``model_path``.
+    model_path : str
+        The persisted model pipeline path.
+    features : list[str]
+        The model features, in the model input column order.
+    batch_size : int
+        The number of transactions per micro-batch.
+    n_jobs : int
+        The number of threads scoring micro-batches concurrently. With
+        more than one thread, the native thread-pools of the model are
+        limited to one thread each.
+    verbose : bool
+        Set to True logs the throughput of each call.
+
+    Example
+    -------
+    ::
+
+        from fraud_prevention.features import cc_transaction_features
+        from fraud_prevention.models import scoring
+
+        scorer = scoring.BatchScorer(batch_size=50_000, n_jobs=4)
+
+        y_score = scorer.score_parquet(cc_transaction_features.PATH)
+
+        scorer.stats
+        Out[1]: {'nb_rows': 284807, 'elapsed_sec': 0.41,
+                 'rows_per_sec': 694651.2}
+    """
+
+    def __init__(self, pipeline=None, model_path=model_experiment.MODEL_PATH,
+                 features=None, batch_size=100_000, n_jobs=1, verbose=False):
+        if pipeline is None:
+            pipeline = model_experiment.load_model(model_path)
+
+        self.pipeline = pipeline
+        self.features = dataset.FEATURES if features is None else features
+        self.batch_size = batch_size
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+        self.stats = {}
+
+    def to_matrix(self, data):
+        """Convert the input data to the model input matrix.
+
+        Parameters
+        ----------
+        data : numpy.ndarray, pyarrow.RecordBatch, pyarrow.Table or
+                pandas.DataFrame
+            The data. Arrays must already be in the ``features`` column
+            order, the other inputs are projected to the ``features``.
+
+        Returns
+        -------
+        X : numpy.ndarray
+            The float matrix with one column per feature.
+        """
+        if isinstance(data, np.ndarray):
+            if data.ndim != 2 or data.shape[1] != len(self.features):
+                raise ValueError(
+                    f'Expected an array of shape (n, {len(self.features)}),'
+                    f' got {data.shape}')
+            return np.asarray(data, dtype=float)
+
+        if isinstance(data, pd.DataFrame):
+            return data[self.features].to_numpy(dtype=float)
+
+        if isinstance(data, (pa.RecordBatch, pa.Table)):
+            X = np.empty((data.num_rows, len(self.features)))
+            for i, feature in enumerate(self.features):
+                column = data.column(feature)
+                if isinstance(column, pa.ChunkedArray):
+                    column = column.combine_chunks()
+                X[:, i] = column.to_numpy(zero_copy_only=False)
+            return X
+
+        raise TypeError(f'Unsupported input type {type(data)}')
+
+    def _predict(self, X):
+        return self.pipeline.predict_proba(X)[:, 1]
+
+    def score(self, data):
+        """Score the transactions.
+
+        Parameters
+        ----------
+        data : numpy.ndarray, pyarrow.RecordBatch, pyarrow.Table or
+                pandas.DataFrame
+            The data.
+
+        Returns
+        -------
+        y_score : numpy.ndarray
+            The fraud score of each transaction.
+        """
+        start = time.perf_counter()
+
+        X = self.to_matrix(data)
+        batches = [
+            X[i:i + self.batch_size]
+            for i in range(0, len(X), self.batch_size)
+        ]
+
+        if self.n_jobs == 1:
+            y_score = [self._predict(batch) for batch in batches]
+        else:
+            with threadpool_limits(limits=1), ThreadPoolExecutor(
+                    max_workers=self.n_jobs) as executor:
+                y_score = list(executor.map(self._predict, batches))
+
+        y_score = np.concatenate(y_score) if y_score else np.empty(0)
+
+        self._update_stats(len(X), time.perf_counter() - start)
+
+        return y_score
+
+    def score_parquet(self, path):
+        """Score the transactions of a parquet file or partitioned folder.
+
+        The files are read in time order, in record batches of
+        ``batch_size`` transactions with only the ``features`` columns,
+        with at most ``2 * n_jobs`` batches in memory at once.
+
+        Parameters
+        ----------
+        path : str
+            The parquet file or ``storage`` partitioned folder path.
+
+        Returns
+        -------
+        y_score : numpy.ndarray
+            The fraud score of each transaction.
+        """
+        start = time.perf_counter()
+
+        batches = storage.iter_batches(
+            path,
+            columns=self.features,
+            batch_size=self.batch_size)
+
+        if self.n_jobs == 1:
+            y_score = [
+                self._predict(self.to_matrix(batch)) for batch in batches]
+        else:
+            def predict_batch(batch):
+                return self._predict(self.to_matrix(batch))
+
+            # At most two batches per thread are read ahead
+            with threadpool_limits(limits=1), ThreadPoolExecutor(
+                    max_workers=self.n_jobs) as executor:
+                y_score = list(map_bounded(
+                    executor,
+                    predict_batch,
+                    batches,
+                    max_pending=2 * self.n_jobs))
+
+        y_score = np.concatenate(y_score) if y_score else np.empty(0)
+
+        self._update_stats(len(y_score), time.perf_counter() - start)
+
+        return y_score
+
+    def _update_stats(self, nb_rows, elapsed_sec):
+        self.stats = {
+            'nb_rows': nb_rows,
+            'elapsed_sec': elapsed_sec,
+            'rows_per_sec': nb_rows / elapsed_sec if elapsed_sec else np.nan
+        }
+
+        if self.verbose:
+            LOGGER.info(
+                'Scored %d rows in %.3fs (%.0f rows/sec)',
+                nb_rows,
+                elapsed_sec,
+                self.stats['rows_per_sec'])
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Online fraud scoring service.
+
+Scores single transactions as they arrive: the transaction features are
+computed from the per card state of an ``OnlineFeatureStore`` and the
+model pipeline persisted with ``model_experiment.save_model``.
+
+Usage::
+
+    python -m fraud_prevention.models.serving --port 8080
+
+    # Score with the compiled trees of a boosted pipeline
+    python -m fraud_prevention.models.serving --port 8080 --compiled
+
+    curl -X POST localhost:8080/score -d '{
+        "credit_card_number": 346024495269014,
+        "timestamp": 172800.0,
+        "latitude": 41.72059,
+        "longitude": -87.70172,
+        "merchant": "restaurant_1",
+        "V1": -1.359807, ..., "V28": -0.021053,
+        "Amount": 149.62}'
+"""
+import json
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from fraud_prevention.features import dataset
+from fraud_prevention.features import online
+from fraud_prevention.features import cc_transaction_features
+from fraud_prevention.models import model_experiment
+from fraud_prevention.models import compiled_trees
+
+
+class FraudScoringService:
+    """Score single transactions.
+
+    Parameters
+    ----------
+    pipeline : sklearn.pipeline.Pipeline or
+            fraud_prevention.models.compiled_trees.CompiledTreeEnsemble
+        The fitted model pipeline or its compiled trees.
+    feature_store : fraud_prevention.features.online.OnlineFeatureStore
+        The online feature store.
+    features : list[str]
+        The model features, in the model input column order.
+    """
+
+    def __init__(self, pipeline, feature_store, features=None):
+        self.pipeline = pipeline
+        self.feature_store = feature_store
+        self.features = dataset.FEATURES if features is None else features
+
+    def score(self, transaction):
+        """Score a transaction.
+
+        The transaction is added to the state of its credit card. Only the
+        features of the feature store can be NaN, e.g. the
+        ``time_prev_transaction`` of the first transaction of a card, a
+        ``ValueError`` is raised for the other missing or null model
+        inputs, before the card state is updated.
+
+        Parameters
+        ----------
+        transaction : dict
+            The transaction, with the keys ``credit_card_number``,
+            ``timestamp``, ``latitude``, ``longitude``, ``merchant`` and
+            the model input features not computed by the feature store.
+
+        Returns
+        -------
+        result : dict
+            The fraud score and the latency in milliseconds.
+        """
+        start = time.perf_counter()
+
+        store_features = set(self.feature_store.feature_names)
+        missing = [
+            f for f in self.features
+            if f not in store_features and transaction.get(f) is None
+        ]
+        if missing:
+            raise ValueError(f'Missing model input features {missing}')
+
+        features = dict(transaction)
+        features.update(self.feature_store.transform(transaction))
+
+        X = np.array(
+            [[features[f] for f in self.features]],
+            dtype=float)
+
+        score = float(self.pipeline.predict_proba(X)[0, 1])
+
+        return {
+            'score': score,
+            'latency_ms': (time.perf_counter() - start) * 1000
+        }
+
+
+def get_service(model_path=model_experiment.MODEL_PATH, compiled=False):
+    """Get the scoring service, warmed-up with the transaction history.
+
+    Parameters
+    ----------
+    model_path : str
+        The persisted model pipeline path.
+    compiled : bool
+        Set to True scores with the compiled trees of the pipeline, see
+        ``compiled_trees.compile_pipeline``.
+
+    Returns
+    -------
+    service : FraudScoringService
+        The scoring service.
+    """
+    data = cc_transaction_features.get()
+
+    feature_store = online.OnlineFeatureStore.from_data(
+        data,
+        merchant_chargeback_woe=(
+            cc_transaction_features.get_merchant_charback_woe(data)))
+
+    pipeline = model_experiment.load_model(model_path)
+    if compiled:
+        pipeline = compiled_trees.compile_pipeline(pipeline)
+
+    return FraudScoringService(
+        pipeline=pipeline,
+        feature_store=feature_store)
+
+
+def serve(service, host='127.0.0.1', port=8080):
+    """Serve the scoring service over HTTP.
+
+    Transactions are scored with ``POST /score`` requests with the
+    transaction as JSON body.
+
+    Parameters
+    ----------
+    service : FraudScoringService
+        The scoring service.
+    host : str
+        The host address.
+    port : int
+        The port.
+    """
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self):
+            if self.path != '/score':
+                self.send_error(404)
+                return
+
+            try:
+                transaction = json.loads(self.rfile.read(
+                    int(self.headers['Content-Length'])))
+                body = json.dumps(service.score(transaction)).encode()
+            except (KeyError, TypeError, ValueError) as err:
+                self.send_error(400, str(err))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--model-path', default=model_experiment.MODEL_PATH)
+    parser.add_argument('--compiled', action='store_true')
+    args = parser.parse_args()
+
+    serve(
+        get_service(model_path=args.model_path, compiled=args.compiled),
+        host=args.host,
+        port=args.port)